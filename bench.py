@@ -0,0 +1,302 @@
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import types
+
+import vc
+
+
+class FakeYoutubeDL:
+    latency = 0.2
+    search_size = 5
+
+    def __init__(self, options):
+        self.options = options
+
+    def extract_info(self, url, download=False):
+        time.sleep(self.latency)
+        if url.startswith('ytsearch'):
+            query = url.split(':', 1)[1]
+            entries = [self.video_info(f"{abs(hash(query)) % 10 ** 9:09d}{i:02d}") for i in range(self.search_size)]
+            if self.options.get('extract_flat'):
+                entries = [{key: entry[key] for key in ('id', 'title', 'duration', 'uploader')} for entry in entries]
+                for entry in entries:
+                    entry['url'] = f"https://www.youtube.com/watch?v={entry['id']}"
+            return {'entries': entries}
+        if self.options.get('extract_flat'):
+            start, end = (int(part) for part in self.options['playlist_items'].split('-'))
+            end = min(end, 500)
+            return {
+                'title': 'Benchmark Playlist',
+                'playlist_count': 500,
+                'entries': [
+                    {'url': f"https://www.youtube.com/watch?v=pl{i:09d}", 'title': f"Playlist Track {i}", 'duration': 180}
+                    for i in range(start, end + 1)
+                ],
+            }
+        return self.video_info(vc.extract_video_id(url) or url[-11:])
+
+    @staticmethod
+    def video_info(video_id):
+        return {
+            'id': video_id,
+            'title': f"Track {video_id}",
+            'duration': 180,
+            'uploader': 'Benchmark',
+            'webpage_url': f"https://www.youtube.com/watch?v={video_id}",
+            'url': f"https://rr1.googlevideo.com/videoplayback?expire={int(time.time()) + 21600}&id={video_id}",
+            'format_id': '251',
+            'ext': 'webm',
+            'acodec': 'opus',
+            'vcodec': 'none',
+            'asr': 48000,
+            'abr': 130.0,
+            'audio_channels': 2,
+        }
+
+    @staticmethod
+    def sanitize_info(data):
+        return data
+
+
+class FakeSource:
+    def __init__(self, source):
+        self.source = source
+
+    def cleanup(self):
+        pass
+
+
+class FakeVoiceClient:
+    def __init__(self, guild, channel, track_seconds):
+        self.guild = guild
+        self.channel = channel
+        self.track_seconds = track_seconds
+        self.playing = False
+        self.paused = False
+        self.after = None
+        self.handle = None
+        self.play_times = []
+        self.end_times = []
+
+    def is_connected(self):
+        return True
+
+    def is_playing(self):
+        return self.playing
+
+    def is_paused(self):
+        return self.paused
+
+    def play(self, source, after=None):
+        self.playing = True
+        self.after = after
+        self.play_times.append(time.perf_counter())
+        self.handle = asyncio.get_running_loop().call_later(self.track_seconds, self.finish)
+
+    def finish(self):
+        if not self.playing:
+            return
+        self.playing = False
+        self.end_times.append(time.perf_counter())
+        if self.after:
+            self.after(None)
+
+    def stop(self):
+        if self.handle:
+            self.handle.cancel()
+        self.finish()
+
+    def pause(self):
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+
+    async def disconnect(self, force=False):
+        self.playing = False
+
+
+class FakeMessage:
+    def __init__(self, channel):
+        self.channel = channel
+
+    async def edit(self, *args, **kwargs):
+        self.channel.edited += 1
+
+
+class FakeTextChannel:
+    def __init__(self, channel_id):
+        self.id = channel_id
+        self.sent = 0
+        self.edited = 0
+
+    async def send(self, *args, **kwargs):
+        self.sent += 1
+        return FakeMessage(self)
+
+
+class FakeVoiceChannel:
+    def __init__(self, guild):
+        self.guild = guild
+        self.id = guild.id + 1
+        self.name = 'Benchmark'
+        self.members = []
+
+
+class FakeGuild:
+    def __init__(self, guild_id, track_seconds):
+        self.id = guild_id
+        self.voice_channel = FakeVoiceChannel(self)
+        self.text_channel = FakeTextChannel(guild_id + 2)
+        self.voice_client = FakeVoiceClient(self, self.voice_channel, track_seconds)
+
+
+class FakeResponse:
+    async def defer(self, *args, **kwargs):
+        pass
+
+    async def send_message(self, *args, **kwargs):
+        pass
+
+
+class FakeFollowup:
+    def __init__(self):
+        self.sent = 0
+
+    async def send(self, *args, **kwargs):
+        self.sent += 1
+
+
+class FakeInteraction:
+    def __init__(self, guild):
+        self.guild = guild
+        self.channel = guild.text_channel
+        self.user = types.SimpleNamespace(
+            display_name='bench',
+            mention='@bench',
+            voice=types.SimpleNamespace(channel=guild.voice_channel)
+        )
+        self.response = FakeResponse()
+        self.followup = FakeFollowup()
+
+
+def make_bot(guilds, workers):
+    vc.yt_dlp = types.SimpleNamespace(YoutubeDL=FakeYoutubeDL)
+    bot = vc.MusicBot()
+    bot.loop = asyncio.get_running_loop()
+    bot.extractor = vc.ExtractionService(bot.ytdl_format_options, max_workers=workers, use_processes=False, metrics=bot.metrics)
+    bot.create_audio_source = lambda source, acodec, before_options=None: FakeSource(source)
+    channels = {guild.text_channel.id: guild.text_channel for guild in guilds.values()}
+    bot.get_channel = channels.get
+    bot.get_guild = guilds.get
+    vc.bot = bot
+    return bot
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    if not samples:
+        return {'count': 0}
+    return {
+        'count': len(samples),
+        'mean_ms': statistics.mean(samples) * 1000,
+        'p50_ms': samples[len(samples) // 2] * 1000,
+        'p95_ms': samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000,
+        'max_ms': samples[-1] * 1000,
+    }
+
+
+async def timed_play(guild, query):
+    interaction = FakeInteraction(guild)
+    start = time.perf_counter()
+    await vc.play_slash.callback(interaction, query)
+    return time.perf_counter() - start
+
+
+async def bench_play_latency(args):
+    guild = FakeGuild(1000, track_seconds=3600)
+    bot = make_bot({guild.id: guild}, args.workers)
+    try:
+        cold = [await timed_play(guild, f"cold query {i}") for i in range(args.iterations)]
+        warm = [await timed_play(guild, "cold query 0") for _ in range(args.iterations)]
+    finally:
+        bot.extractor.shutdown()
+    return {'cold': summarize(cold), 'warm': summarize(warm)}
+
+
+async def bench_transition_gap(args):
+    guild = FakeGuild(2000, track_seconds=args.track_seconds)
+    bot = make_bot({guild.id: guild}, args.workers)
+    try:
+        tracks = [
+            vc.Track(url=f"https://www.youtube.com/watch?v=gap{i:08d}", title=f"Gap {i}", duration=180,
+                     requester_name='bench', request_channel_id=guild.text_channel.id)
+            for i in range(args.iterations + 1)
+        ]
+        bot.get_queue(guild.id).extend(tracks)
+        voice_client = guild.voice_client
+        await bot.play_next(guild.id, voice_client)
+        while len(voice_client.play_times) < len(tracks):
+            await asyncio.sleep(args.track_seconds / 4)
+        gaps = [start - end for end, start in zip(voice_client.end_times, voice_client.play_times[1:])]
+    finally:
+        bot.extractor.shutdown()
+    return summarize(gaps)
+
+
+async def bench_guild_scaling(args):
+    results = {}
+    for count in args.guilds:
+        guilds = {3000 + i * 10: FakeGuild(3000 + i * 10, track_seconds=3600) for i in range(count)}
+        bot = make_bot(guilds, args.workers)
+        try:
+            start = time.perf_counter()
+            latencies = await asyncio.gather(*(
+                timed_play(guild, f"guild {guild.id} query {i}")
+                for guild in guilds.values()
+                for i in range(args.plays_per_guild)
+            ))
+            elapsed = time.perf_counter() - start
+        finally:
+            bot.extractor.shutdown()
+        results[str(count)] = {
+            'wall_s': elapsed,
+            'plays_per_s': len(latencies) / elapsed,
+            'latency': summarize(latencies),
+        }
+    return results
+
+
+async def main(args):
+    FakeYoutubeDL.latency = args.latency
+    report = {
+        'config': {
+            'latency_s': args.latency,
+            'track_seconds': args.track_seconds,
+            'iterations': args.iterations,
+            'workers': args.workers,
+        },
+        'play_latency': await bench_play_latency(args),
+        'transition_gap': await bench_transition_gap(args),
+        'guild_scaling': await bench_guild_scaling(args),
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the music bot hot paths")
+    parser.add_argument('--latency', type=float, default=0.2, help="Simulated yt-dlp extraction latency in seconds")
+    parser.add_argument('--track-seconds', type=float, default=0.5, help="Simulated track length in seconds")
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--workers', type=int, default=4, help="Extraction worker threads")
+    parser.add_argument('--guilds', type=lambda value: [int(part) for part in value.split(',')], default=[1, 10, 50])
+    parser.add_argument('--plays-per-guild', type=int, default=2)
+    parser.add_argument('--output', help="Also write the JSON report to this file")
+    asyncio.run(main(parser.parse_args()))
@@ -1,10 +1,1320 @@
+import time
+
+PROCESS_STARTED_AT = time.perf_counter()
+
+import aiohttp
 import discord
+from aiohttp import web
 from discord import app_commands
 from discord.ext import commands
-import yt_dlp
 import asyncio
+import hashlib
+import heapq
+import json
+import multiprocessing
 import os
+import queue as queue_module
+import random
+import re
+import sqlite3
+import sys
+import threading
+from bisect import bisect_left, insort
+from collections import OrderedDict, defaultdict, deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from typing import Optional
+from urllib.parse import urlparse, parse_qs
+
+
+YOUTUBE_ID_RE = re.compile(r'(?:v=|youtu\.be/|shorts/|embed/|live/)([A-Za-z0-9_-]{11})')
+
+
+def is_playlist_url(url):
+    # Watch URLs that also carry a list= still play just the video, as with noplaylist
+    return 'list=' in url and extract_video_id(url) is None
+
+
+def format_idle_time(seconds):
+    if seconds % 60:
+        return f"{seconds} second{'s' if seconds != 1 else ''}"
+    minutes = seconds // 60
+    return f"{minutes} minute{'s' if minutes != 1 else ''}"
+
+
+def normalize_text(text):
+    return " ".join(text.lower().split())
+
+
+def extract_video_id(url):
+    if not url:
+        return None
+    match = YOUTUBE_ID_RE.search(url)
+    if match:
+        return match.group(1)
+    return None
+
+
+class Track:
+    __slots__ = ('url', 'title', 'duration', 'uploader', 'requester_name', 'request_channel_id', 'start_offset', 'stream')
+
+    def __init__(self, url, title, duration=None, uploader=None, requester_name=None, request_channel_id=None, start_offset=0, stream=None):
+        self.url = url
+        self.title = title
+        self.duration = int(duration) if duration else None
+        self.uploader = uploader
+        self.requester_name = requester_name
+        self.request_channel_id = request_channel_id
+        self.start_offset = start_offset
+        # Stream info resolved while searching, reused at play time while the signed URL is valid
+        self.stream = stream
+
+    def to_dict(self):
+        # Signed stream URLs are short-lived, so they're not worth persisting
+        return {name: getattr(self, name) for name in self.__slots__ if name != 'stream'}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{name: data[name] for name in cls.__slots__ if name in data})
+
+    @classmethod
+    def from_entry(cls, entry, requester_name=None, request_channel_id=None, fallback_url=None):
+        return cls(
+            url=entry.get('webpage_url') or entry.get('url') or entry.get('original_url', fallback_url),
+            title=entry.get('title', 'Unknown Title'),
+            duration=entry.get('duration'),
+            uploader=entry.get('uploader') or entry.get('channel') or 'Unknown',
+            requester_name=requester_name,
+            request_channel_id=request_channel_id,
+            stream=entry.get('stream')
+        )
+
+    def __repr__(self):
+        return f"<Track title={self.title!r} url={self.url!r}>"
+
+    def memory_size(self):
+        size = sys.getsizeof(self)
+        for name in self.__slots__:
+            value = getattr(self, name)
+            if isinstance(value, str):
+                size += sys.getsizeof(value)
+        if self.stream:
+            size += sys.getsizeof(self.stream) + sum(sys.getsizeof(value) for value in self.stream.values())
+        return size
+
+
+class GuildQueue:
+    __slots__ = ('tracks', 'keys', 'guild_id', 'store')
+
+    def __init__(self, tracks=(), guild_id=None, store=None, keys=None):
+        self.tracks = deque(tracks)
+        # Sort keys of the stored rows, in step with tracks, so edits touch single rows
+        self.keys = deque(keys if keys is not None else range(len(self.tracks)))
+        self.guild_id = guild_id
+        self.store = store
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def __bool__(self):
+        return bool(self.tracks)
+
+    def __iter__(self):
+        return iter(self.tracks)
+
+    def append(self, track):
+        self.extend([track])
+
+    def extend(self, tracks):
+        tracks = list(tracks)
+        first = self.keys[-1] + 1 if self.keys else 0
+        keys = [first + i for i in range(len(tracks))]
+        self.tracks.extend(tracks)
+        self.keys.extend(keys)
+        if self.store:
+            self.store.queue_append(self.guild_id, zip(keys, tracks))
+
+    def push_front(self, track):
+        key = self.keys[0] - 1 if self.keys else 0
+        self.tracks.appendleft(track)
+        self.keys.appendleft(key)
+        if self.store:
+            self.store.queue_append(self.guild_id, [(key, track)])
+
+    def peek(self):
+        return self.tracks[0] if self.tracks else None
+
+    def advance(self):
+        if not self.tracks:
+            return None
+        key = self.keys.popleft()
+        if self.store:
+            self.store.queue_delete(self.guild_id, key)
+        return self.tracks.popleft()
+
+    def remove(self, index):
+        track = self.tracks[index]
+        key = self.keys[index]
+        del self.tracks[index]
+        del self.keys[index]
+        if self.store:
+            self.store.queue_delete(self.guild_id, key)
+        return track
+
+    def move(self, source, destination):
+        track = self.tracks[source]
+        key = self.keys[source]
+        del self.tracks[source]
+        del self.keys[source]
+        before = self.keys[destination - 1] if destination > 0 else None
+        after = self.keys[destination] if destination < len(self.keys) else None
+        if before is None and after is None:
+            new_key = key
+        elif before is None:
+            new_key = after - 1
+        elif after is None:
+            new_key = before + 1
+        else:
+            new_key = (before + after) / 2
+        self.tracks.insert(destination, track)
+        if new_key in (before, after):
+            # Repeated moves into the same gap have run out of float precision
+            self.renumber()
+            return track
+        self.keys.insert(destination, new_key)
+        if self.store and new_key != key:
+            self.store.queue_rekey(self.guild_id, key, new_key)
+        return track
+
+    def shuffle(self):
+        tracks = list(self.tracks)
+        random.shuffle(tracks)
+        self.tracks = deque(tracks)
+        self.renumber()
+
+    def renumber(self):
+        self.keys = deque(range(len(self.tracks)))
+        if self.store:
+            self.store.queue_replace(self.guild_id, self.tracks)
+
+    def clear(self):
+        self.tracks.clear()
+        self.keys.clear()
+        if self.store:
+            self.store.queue_clear(self.guild_id)
+
+    def truncate(self, length):
+        if length >= len(self.tracks):
+            return
+        cut = self.keys[length]
+        while len(self.tracks) > length:
+            self.tracks.pop()
+            self.keys.pop()
+        if self.store:
+            self.store.queue_truncate(self.guild_id, cut)
+
+    def page(self, start, count):
+        return list(islice(self.tracks, start, start + count))
+
+    def memory_size(self):
+        return sys.getsizeof(self.tracks) + sys.getsizeof(self.keys) + sum(track.memory_size() for track in self.tracks)
+
+
+class GuildState:
+    __slots__ = ('guild_id', 'queue', 'loop_state', 'now_playing', 'current_source', 'prefetch',
+                 'playlist_task', 'idle_timer', 'track_ended_at', 'recovery', 'last_active')
+
+    def __init__(self, guild_id, queue, loop_state=False):
+        self.guild_id = guild_id
+        self.queue = queue
+        self.loop_state = loop_state
+        self.now_playing = None
+        self.current_source = None
+        # (task, url) of the stream being resolved ahead of the next track
+        self.prefetch = None
+        self.playlist_task = None
+        self.idle_timer = None
+        self.track_ended_at = None
+        # (track, attempts, position) of the last stream recovery
+        self.recovery = None
+        self.last_active = time.monotonic()
+
+    def busy(self):
+        tasks = (self.prefetch[0] if self.prefetch else None, self.playlist_task, self.idle_timer)
+        return self.now_playing is not None or any(task and not task.done() for task in tasks)
+
+    def memory_size(self):
+        size = sys.getsizeof(self) + self.queue.memory_size()
+        if self.now_playing:
+            size += self.now_playing.memory_size()
+        return size
+
+
+class GuildRegistry:
+    def __init__(self, factory, idle_ttl=1800, memory_budget=64 * 1024 ** 2):
+        self.factory = factory
+        self.idle_ttl = idle_ttl
+        self.memory_budget = memory_budget
+        self.states = {}
+        self.evicted = 0
+        self.trimmed = 0
+
+    def __len__(self):
+        return len(self.states)
+
+    def __iter__(self):
+        return iter(list(self.states.values()))
+
+    def get(self, guild_id):
+        state = self.states.get(guild_id)
+        if state is None:
+            state = self.states[guild_id] = self.factory(guild_id)
+        state.last_active = time.monotonic()
+        return state
+
+    def peek(self, guild_id):
+        return self.states.get(guild_id)
+
+    def add(self, state):
+        state.last_active = time.monotonic()
+        self.states[state.guild_id] = state
+        return state
+
+    def evict_idle(self, has_voice):
+        cutoff = time.monotonic() - self.idle_ttl
+        evicted = [
+            guild_id for guild_id, state in self.states.items()
+            if state.last_active < cutoff and not state.busy() and not has_voice(guild_id)
+        ]
+        for guild_id in evicted:
+            del self.states[guild_id]
+        self.evicted += len(evicted)
+        return evicted
+
+    def enforce_budget(self):
+        sizes = {guild_id: state.memory_size() for guild_id, state in self.states.items()}
+        excess = sum(sizes.values()) - self.memory_budget
+        if excess <= 0:
+            return 0
+
+        # Always cut from the tail of whichever queue is currently largest
+        heap = [(-size, guild_id) for guild_id, size in sizes.items() if self.states[guild_id].queue]
+        heapq.heapify(heap)
+        keep = {}
+        while excess > 0 and heap:
+            size, guild_id = heapq.heappop(heap)
+            tracks = self.states[guild_id].queue.tracks
+            length = keep.get(guild_id, len(tracks))
+            if not length:
+                continue
+            length -= 1
+            keep[guild_id] = length
+            freed = tracks[length].memory_size()
+            excess -= freed
+            heapq.heappush(heap, (size + freed, guild_id))
+
+        trimmed = 0
+        for guild_id, length in keep.items():
+            queue = self.states[guild_id].queue
+            trimmed += len(queue) - length
+            print(f"Trimming guild {guild_id} queue to {length} songs to stay within the memory budget")
+            queue.truncate(length)
+        self.trimmed += trimmed
+        return trimmed
+
+    def memory_usage(self):
+        sizes = [state.memory_size() for state in self.states.values()]
+        return {
+            'guilds': len(sizes),
+            'tracks': sum(len(state.queue) for state in self.states.values()),
+            'bytes': sum(sizes) + sys.getsizeof(self.states),
+            'budget_bytes': self.memory_budget,
+            'evicted_total': self.evicted,
+            'trimmed_total': self.trimmed,
+        }
+
+
+class SQLiteStore:
+    schema = ""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(self.schema)
+        self.connection.commit()
+        # Writes are queued here and committed in batches off the event loop
+        self.pending = []
+        self.closed = False
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def write(self, sql, params):
+        if not self.closed:
+            self.pending.append((sql, params))
+
+    def flush_sync(self):
+        # Take the batch under the lock too, so batches commit in the order they were taken
+        with self.lock:
+            if not self.pending:
+                return
+            pending, self.pending = self.pending, []
+            with self.connection:
+                for sql, params in pending:
+                    self.connection.execute(sql, params)
+
+    async def flush(self):
+        await asyncio.get_running_loop().run_in_executor(self.executor, self.flush_sync)
+
+    def close(self):
+        self.flush_sync()
+        self.closed = True
+        self.executor.shutdown(wait=True)
+        with self.lock:
+            self.connection.close()
+
+
+class StateStore(SQLiteStore):
+    schema = """
+            CREATE TABLE IF NOT EXISTS guild_state (
+                guild_id INTEGER PRIMARY KEY,
+                loop_state INTEGER NOT NULL DEFAULT 0,
+                now_playing TEXT,
+                position REAL NOT NULL DEFAULT 0,
+                voice_channel_id INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS queue_items (
+                guild_id INTEGER NOT NULL,
+                seq REAL NOT NULL,
+                track TEXT NOT NULL,
+                PRIMARY KEY (guild_id, seq)
+            );
+        """
+
+    def load_guild(self, guild_id):
+        self.flush_sync()
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT seq, track FROM queue_items WHERE guild_id = ? ORDER BY seq", (guild_id,)
+            ).fetchall()
+            state = self.connection.execute(
+                "SELECT loop_state, now_playing, position FROM guild_state WHERE guild_id = ?", (guild_id,)
+            ).fetchone()
+        items = [(seq, Track.from_dict(json.loads(track))) for seq, track in rows]
+        if state is None:
+            return items, False, None, 0
+        loop_state, now_playing, position = state
+        now_playing = Track.from_dict(json.loads(now_playing)) if now_playing else None
+        return items, bool(loop_state), now_playing, position
+
+    def saved_sessions(self):
+        with self.lock:
+            return self.connection.execute(
+                "SELECT guild_id, voice_channel_id FROM guild_state WHERE now_playing IS NOT NULL AND voice_channel_id IS NOT NULL"
+            ).fetchall()
+
+    def queue_append(self, guild_id, items):
+        for seq, track in items:
+            self.write("INSERT OR REPLACE INTO queue_items (guild_id, seq, track) VALUES (?, ?, ?)",
+                       (guild_id, seq, json.dumps(track.to_dict())))
+
+    def queue_delete(self, guild_id, seq):
+        self.write("DELETE FROM queue_items WHERE guild_id = ? AND seq = ?", (guild_id, seq))
+
+    def queue_rekey(self, guild_id, seq, new_seq):
+        self.write("UPDATE queue_items SET seq = ? WHERE guild_id = ? AND seq = ?", (new_seq, guild_id, seq))
+
+    def queue_clear(self, guild_id):
+        self.write("DELETE FROM queue_items WHERE guild_id = ?", (guild_id,))
+
+    def queue_replace(self, guild_id, tracks):
+        self.queue_clear(guild_id)
+        self.queue_append(guild_id, enumerate(tracks))
+
+    def queue_truncate(self, guild_id, seq):
+        self.write("DELETE FROM queue_items WHERE guild_id = ? AND seq >= ?", (guild_id, seq))
+
+    def set_loop_state(self, guild_id, state):
+        self.write("INSERT INTO guild_state (guild_id, loop_state) VALUES (?, ?) "
+                   "ON CONFLICT(guild_id) DO UPDATE SET loop_state = excluded.loop_state",
+                   (guild_id, int(state)))
+
+    def set_now_playing(self, guild_id, track, voice_channel_id=None):
+        now_playing = json.dumps(track.to_dict()) if track else None
+        self.write("INSERT INTO guild_state (guild_id, now_playing, position, voice_channel_id) VALUES (?, ?, ?, ?) "
+                   "ON CONFLICT(guild_id) DO UPDATE SET now_playing = excluded.now_playing, "
+                   "position = excluded.position, voice_channel_id = excluded.voice_channel_id",
+                   (guild_id, now_playing, track.start_offset if track else 0, voice_channel_id))
+
+    def set_position(self, guild_id, position):
+        self.write("UPDATE guild_state SET position = ? WHERE guild_id = ?", (position, guild_id))
+
+
+class MetadataStore(SQLiteStore):
+    schema = """
+            CREATE TABLE IF NOT EXISTS tracks (
+                video_id TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                title TEXT,
+                duration INTEGER,
+                uploader TEXT,
+                format_id TEXT,
+                play_count INTEGER NOT NULL DEFAULT 0,
+                last_played REAL
+            );
+            CREATE TABLE IF NOT EXISTS queries (
+                query TEXT PRIMARY KEY,
+                video_ids TEXT NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0,
+                last_used REAL
+            );
+        """
+
+    def record_track(self, video_id, entry):
+        self.write("INSERT INTO tracks (video_id, url, title, duration, uploader) VALUES (?, ?, ?, ?, ?) "
+                   "ON CONFLICT(video_id) DO UPDATE SET url = excluded.url, title = excluded.title, "
+                   "duration = excluded.duration, uploader = excluded.uploader",
+                   (video_id, entry['webpage_url'], entry['title'], entry['duration'], entry['uploader']))
+
+    def record_search(self, query, entries):
+        video_ids = []
+        for entry in entries:
+            video_id = entry.get('id') or extract_video_id(entry['webpage_url'])
+            if video_id and entry['webpage_url']:
+                self.record_track(video_id, entry)
+                video_ids.append(video_id)
+        if video_ids:
+            self.record_query(query, video_ids)
+
+    def record_query(self, query, video_ids):
+        self.write("INSERT INTO queries (query, video_ids, hits, last_used) VALUES (?, ?, 1, ?) "
+                   "ON CONFLICT(query) DO UPDATE SET video_ids = excluded.video_ids, "
+                   "hits = hits + 1, last_used = excluded.last_used",
+                   (SearchCache.normalize(query), json.dumps(video_ids), time.time()))
+
+    def record_hit(self, query):
+        self.write("UPDATE queries SET hits = hits + 1, last_used = ? WHERE query = ?",
+                   (time.time(), SearchCache.normalize(query)))
+
+    def record_play(self, video_id, track, format_id=None):
+        self.write("INSERT INTO tracks (video_id, url, title, duration, uploader, format_id, play_count, last_played) "
+                   "VALUES (?, ?, ?, ?, ?, ?, 1, ?) "
+                   "ON CONFLICT(video_id) DO UPDATE SET play_count = play_count + 1, last_played = excluded.last_played, "
+                   "format_id = COALESCE(excluded.format_id, format_id)",
+                   (video_id, track.url, track.title, track.duration, track.uploader, format_id, time.time()))
+
+    def hottest(self, limit):
+        # Runs in the executor: read just the most requested rows, never the whole table
+        with self.lock:
+            queries = self.connection.execute(
+                "SELECT query, video_ids, hits FROM queries ORDER BY hits DESC, last_used DESC LIMIT ?", (limit,)
+            ).fetchall()
+            played = self.connection.execute(
+                "SELECT title, play_count FROM tracks WHERE play_count > 0 ORDER BY play_count DESC LIMIT ?", (limit,)
+            ).fetchall()
+            video_ids = {video_id for _, ids, _ in queries for video_id in json.loads(ids)}
+            tracks = {}
+            for video_id in video_ids:
+                row = self.connection.execute(
+                    "SELECT url, title, duration, uploader FROM tracks WHERE video_id = ?", (video_id,)
+                ).fetchone()
+                if row:
+                    tracks[video_id] = row
+        
+        searches = []
+        for query, ids, hits in queries:
+            entries = [
+                {'id': video_id, 'title': tracks[video_id][1], 'duration': tracks[video_id][2],
+                 'uploader': tracks[video_id][3], 'webpage_url': tracks[video_id][0], 'stream': None}
+                for video_id in json.loads(ids) if video_id in tracks
+            ]
+            if entries:
+                searches.append((query, hits, entries))
+        return searches, played
+
+
+class SuggestionIndex:
+    def __init__(self, max_entries=5000, max_scan=200):
+        self.max_entries = max_entries
+        self.max_scan = max_scan
+        self.keys = []
+        self.entries = {}
+
+    def add(self, text, weight=1):
+        text = text.strip()[:100]
+        key = normalize_text(text)
+        if not key:
+            return
+        entry = self.entries.get(key)
+        if entry is None:
+            self.entries[key] = [text, weight]
+            insort(self.keys, key)
+            # Trim in batches so a full index doesn't pay for a sort on every insert
+            if len(self.keys) > self.max_entries * 1.1:
+                self.trim()
+        else:
+            entry[1] += weight
+
+    def trim(self):
+        keep = sorted(self.entries, key=lambda key: self.entries[key][1], reverse=True)[:self.max_entries]
+        self.entries = {key: self.entries[key] for key in keep}
+        self.keys = sorted(self.entries)
+
+    def suggest(self, prefix, limit=25):
+        prefix = normalize_text(prefix)
+        if not prefix:
+            return [text for text, _ in heapq.nlargest(limit, self.entries.values(), key=lambda entry: entry[1])]
+        start = bisect_left(self.keys, prefix)
+        matches = []
+        for key in islice(self.keys, start, start + self.max_scan):
+            if not key.startswith(prefix):
+                break
+            matches.append(self.entries[key])
+        matches.sort(key=lambda entry: entry[1], reverse=True)
+        return [text for text, _ in matches[:limit]]
+
+
+class SearchCache:
+    def __init__(self, ttl=600, max_entries=512):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(query):
+        query = query.strip()
+        # Video IDs are case-sensitive, so only text searches are folded together
+        if query.startswith(('http://', 'https://')):
+            return query
+        return normalize_text(query)
+
+    def get(self, query):
+        key = self.normalize(query)
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        stored_at, results = entry
+        if time.monotonic() - stored_at > self.ttl:
+            del self.entries[key]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return results
+
+    def put(self, query, results):
+        key = self.normalize(query)
+        self.entries[key] = (time.monotonic(), results)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+
+class StreamURLCache:
+    def __init__(self, expiry_margin=300, default_ttl=3600, max_entries=1024):
+        self.expiry_margin = expiry_margin
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def parse_expiry(url):
+        try:
+            parsed = urlparse(url)
+            expire = parse_qs(parsed.query).get('expire')
+            if expire:
+                return int(expire[0])
+            # Some googlevideo URLs carry their parameters as path segments
+            parts = parsed.path.split('/')
+            if 'expire' in parts:
+                return int(parts[parts.index('expire') + 1])
+        except (ValueError, IndexError):
+            pass
+        return None
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, stream = entry
+        if time.time() >= expires_at - self.expiry_margin:
+            del self.entries[key]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return stream
+
+    def put(self, key, stream):
+        expires_at = self.parse_expiry(stream['url']) or time.time() + self.default_ttl
+        self.entries[key] = (expires_at, stream)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, key):
+        self.entries.pop(key, None)
+
+    def is_fresh(self, stream):
+        expires_at = self.parse_expiry(stream['url'])
+        if expires_at is None:
+            expires_at = stream['resolved_at'] + self.default_ttl
+        return time.time() < expires_at - self.expiry_margin
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+
+class ExtractionError(Exception):
+    pass
+
+
+class AudioCache:
+    def __init__(self, directory, max_bytes=2 * 1024 ** 3, chunk_size=10 * 1024 ** 2, write_size=256 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.write_size = write_size
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.downloads = {}
+        self.session = None
+        self.hits = 0
+        self.misses = 0
+
+    def load(self):
+        os.makedirs(self.directory, exist_ok=True)
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith('.part'):
+                os.remove(path)
+                continue
+            stat = os.stat(path)
+            files.append((stat.st_mtime, os.path.splitext(name)[0], path, stat.st_size))
+        for _, video_id, path, size in sorted(files):
+            self.entries[video_id] = (path, size)
+            self.total_bytes += size
+        self.evict()
+        return self
+
+    def get(self, video_id):
+        entry = self.entries.get(video_id)
+        if entry is None or not os.path.exists(entry[0]):
+            if entry is not None:
+                self.discard(video_id)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(video_id)
+        # Keep mtime as the LRU order so it survives restarts
+        os.utime(entry[0])
+        self.hits += 1
+        return entry[0]
+
+    def discard(self, video_id):
+        entry = self.entries.pop(video_id, None)
+        if entry is None:
+            return
+        path, size = entry
+        self.total_bytes -= size
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def evict(self):
+        while self.total_bytes > self.max_bytes and self.entries:
+            self.discard(next(iter(self.entries)))
+
+    def schedule_download(self, video_id, stream, loop):
+        if video_id in self.entries or video_id in self.downloads:
+            return
+        task = loop.create_task(self.download(video_id, stream))
+        self.downloads[video_id] = task
+        task.add_done_callback(lambda _: self.downloads.pop(video_id, None))
+
+    async def download(self, video_id, stream):
+        if self.session is None:
+            self.session = aiohttp.ClientSession()
+        path = os.path.join(self.directory, f"{video_id}.{stream.get('ext') or 'webm'}")
+        part_path = path + '.part'
+        headers = dict(stream.get('http_headers') or {})
+        loop = asyncio.get_running_loop()
+        size = 0
+        file = None
+        try:
+            # Disk writes go through the executor so a slow disk never stalls playback
+            file = await loop.run_in_executor(None, open, part_path, 'wb')
+            # Ranged requests avoid the throttling googlevideo applies to one long read
+            while True:
+                headers['Range'] = f"bytes={size}-{size + self.chunk_size - 1}"
+                received = 0
+                async with self.session.get(stream['url'], headers=headers) as response:
+                    if response.status not in (200, 206):
+                        raise Exception(f"HTTP {response.status}")
+                    async for data in response.content.iter_chunked(self.write_size):
+                        await loop.run_in_executor(None, file.write, data)
+                        received += len(data)
+                        if size + received > self.max_bytes:
+                            raise Exception("Track is larger than the audio cache")
+                size += received
+                if response.status == 200 or received < self.chunk_size:
+                    break
+            await loop.run_in_executor(None, file.close)
+            await loop.run_in_executor(None, os.replace, part_path, path)
+        except asyncio.CancelledError:
+            if file is not None:
+                file.close()
+            self.remove_partial(part_path)
+            raise
+        except Exception as e:
+            print(f"Error caching audio for {video_id}: {e}")
+            if file is not None:
+                file.close()
+            self.remove_partial(part_path)
+            return
+
+        self.entries[video_id] = (path, size)
+        self.total_bytes += size
+        self.evict()
+
+    @staticmethod
+    def remove_partial(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    async def close(self):
+        for task in list(self.downloads.values()):
+            task.cancel()
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'bytes': self.total_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+
+class StatusUpdater:
+    def __init__(self, min_interval=1.0):
+        self.min_interval = min_interval
+        self.pending = {}
+        self.messages = {}
+        self.contents = {}
+        self.tasks = {}
+        self.last_sent = {}
+        self.coalesced = 0
+        self.skipped = 0
+
+    def update(self, key, channel, embed, persistent=True):
+        # A newer update for the same key replaces one that hasn't been sent yet
+        if key in self.pending:
+            self.coalesced += 1
+        self.pending[key] = (channel, embed, persistent)
+        task = self.tasks.get(key)
+        if task is None or task.done():
+            self.tasks[key] = asyncio.ensure_future(self.flush(key))
+
+    def forget(self, key):
+        self.pending.pop(key, None)
+        self.messages.pop(key, None)
+        self.contents.pop(key, None)
+        task = self.tasks.pop(key, None)
+        if task and not task.done() and task is not asyncio.current_task():
+            task.cancel()
+
+    def prune(self):
+        # Once min_interval has passed a channel's last send no longer delays anything
+        cutoff = time.monotonic() - self.min_interval
+        for channel_id in [channel_id for channel_id, sent_at in self.last_sent.items() if sent_at < cutoff]:
+            del self.last_sent[channel_id]
+
+    async def flush(self, key):
+        try:
+            await self.send_pending(key)
+        finally:
+            if self.tasks.get(key) is asyncio.current_task():
+                del self.tasks[key]
+
+    async def send_pending(self, key):
+        while key in self.pending:
+            channel = self.pending[key][0]
+            wait = self.last_sent.get(channel.id, 0) + self.min_interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+
+            channel, embed, persistent = self.pending.pop(key)
+            content = embed.to_dict()
+            message = self.messages.get(key)
+            if message is not None and message.channel.id == channel.id and self.contents.get(key) == content:
+                self.skipped += 1
+                continue
+
+            self.last_sent[channel.id] = time.monotonic()
+            try:
+                if message is not None and message.channel.id == channel.id:
+                    try:
+                        await message.edit(embed=embed)
+                    except discord.NotFound:
+                        message = await channel.send(embed=embed)
+                else:
+                    message = await channel.send(embed=embed)
+            except discord.HTTPException as e:
+                if e.status == 429 and key not in self.pending:
+                    self.pending[key] = (channel, embed, persistent)
+                    await asyncio.sleep(getattr(e, 'retry_after', None) or self.min_interval)
+                else:
+                    print(f"Error sending status message: {e}")
+                continue
+
+            if persistent:
+                self.messages[key] = message
+                self.contents[key] = content
+
+
+# yt-dlp container extension -> FFmpeg demuxer, so known formats can skip probing
+FFMPEG_DEMUXERS = {
+    'webm': 'matroska',
+    'mkv': 'matroska',
+    'm4a': 'mov',
+    'mp4': 'mov',
+    'mp3': 'mp3',
+    'ogg': 'ogg',
+    'opus': 'ogg',
+}
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum {self.sum}')
+        lines.append(f'{name}_count {self.count}')
+        return lines
+
+    def snapshot(self):
+        return {
+            'buckets': dict(zip(map(str, self.buckets), self.counts)),
+            'overflow': self.counts[-1],
+            'sum': self.sum,
+            'count': self.count,
+        }
+
+
+class Metrics:
+    def __init__(self):
+        self.histograms = {}
+        self.counters = defaultdict(int)
+        self.gauges = {}
+        self.labels = {}
+        self.help = {}
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.histograms[name] = Histogram(buckets)
+        self.help[name] = help_text
+
+    def counter(self, name, help_text):
+        # Registered up front so the counter is exported at zero before anything happens
+        self.counters[name] += 0
+        self.help[name] = help_text
+
+    def gauge(self, name, help_text, callback, label=None):
+        # callback returns a number, or a dict of label value -> number
+        self.gauges[name] = callback
+        self.labels[name] = label
+        self.help[name] = help_text
+
+    def observe(self, name, value):
+        self.histograms[name].observe(value)
+
+    def increment(self, name, amount=1):
+        self.counters[name] += amount
+
+    def read_gauges(self):
+        values = {}
+        for name, callback in self.gauges.items():
+            try:
+                values[name] = callback()
+            except Exception as e:
+                print(f"Error reading metric {name}: {e}")
+        return values
+
+    def render(self):
+        lines = []
+        for name, histogram in self.histograms.items():
+            lines.append(f"# HELP {name} {self.help[name]}")
+            lines.append(f"# TYPE {name} histogram")
+            lines.extend(histogram.render(name))
+        for name, value in sorted(self.counters.items()):
+            if name in self.help:
+                lines.append(f"# HELP {name} {self.help[name]}")
+            lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name} {value}")
+        for name, value in self.read_gauges().items():
+            lines.append(f"# HELP {name} {self.help[name]}")
+            lines.append(f"# TYPE {name} gauge")
+            if isinstance(value, dict):
+                label = self.labels.get(name) or 'name'
+                for key, item in value.items():
+                    lines.append(f'{name}{{{label}="{key}"}} {item}')
+            else:
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        return {
+            'timestamp': time.time(),
+            'histograms': {name: histogram.snapshot() for name, histogram in self.histograms.items()},
+            'counters': dict(self.counters),
+            'gauges': self.read_gauges(),
+        }
+
+
+class TimedAudioSource(discord.AudioSource):
+    # Records the delay between spawning FFmpeg and the first packet reaching the voice client,
+    # and counts 20ms frames so the playback position survives pauses
+    FRAME_SECONDS = 0.02
+
+    def __init__(self, original, metrics, start_offset=0):
+        self.original = original
+        self.metrics = metrics
+        self.start_offset = start_offset
+        self.created_at = time.perf_counter()
+        self.first_packet = True
+        self.frames = 0
+        self.ended = False
+
+    @property
+    def position(self):
+        return self.start_offset + self.frames * self.FRAME_SECONDS
+
+    def read(self):
+        data = self.original.read()
+        if self.first_packet:
+            self.first_packet = False
+            self.metrics.observe('ffmpeg_first_packet_seconds', time.perf_counter() - self.created_at)
+        if data:
+            self.frames += 1
+        else:
+            # An empty read means FFmpeg stopped producing audio, as opposed to stop() being called
+            self.ended = True
+        return data
+
+    def is_opus(self):
+        return self.original.is_opus()
+
+    def cleanup(self):
+        self.original.cleanup()
+
+
+# yt-dlp takes a noticeable part of startup to import, so workers load it on first use
+yt_dlp = None
+_worker_ytdl_options = None
+_worker_local = threading.local()
+
+
+def _load_yt_dlp():
+    global yt_dlp
+    if yt_dlp is None:
+        import yt_dlp as module
+        yt_dlp = module
+    return yt_dlp
+
+
+def _init_extraction_worker(ytdl_options):
+    global _worker_ytdl_options
+    _worker_ytdl_options = ytdl_options
+
+
+def _get_worker_ytdl(extra_options=None):
+    # Each worker process (or thread) keeps its own YoutubeDL instance per set of extra options
+    instances = getattr(_worker_local, 'ytdl', None)
+    if instances is None:
+        instances = _worker_local.ytdl = OrderedDict()
+    key = tuple(sorted(extra_options.items())) if extra_options else ()
+    ytdl = instances.get(key)
+    if ytdl is None:
+        ytdl = _load_yt_dlp().YoutubeDL({**_worker_ytdl_options, **(extra_options or {})})
+        instances[key] = ytdl
+        # Playlist chunks each carry their own item range, so don't keep every one
+        while len(instances) > 8:
+            instances.popitem(last=False)
+    else:
+        instances.move_to_end(key)
+    return ytdl
+
+
+def _warm_worker():
+    _get_worker_ytdl()
+    return os.getpid()
+
+
+def _extract_in_worker(url, extra_options=None):
+    ytdl = _get_worker_ytdl(extra_options)
+    try:
+        data = ytdl.extract_info(url, download=False)
+    except Exception as e:
+        # yt-dlp errors hold references that can't be pickled back to the parent
+        raise ExtractionError(str(e)) from None
+    return ytdl.sanitize_info(data)
+
+
+PRIORITY_PLAY = 0
+PRIORITY_SEARCH = 1
+PRIORITY_BACKGROUND = 2
+
+
+class ExtractionOverloaded(Exception):
+    pass
+
+
+class ExtractionJob:
+    __slots__ = ('key', 'url', 'extra_options', 'guild_id', 'priority', 'future', 'started', 'waiters', 'concurrency')
+
+    def __init__(self, key, url, extra_options, guild_id, priority, future, concurrency=None):
+        self.key = key
+        self.url = url
+        self.extra_options = extra_options
+        self.guild_id = guild_id
+        self.priority = priority
+        self.future = future
+        self.started = False
+        self.waiters = 0
+        self.concurrency = concurrency
+
+
+class ExtractionService:
+    def __init__(self, ytdl_options, max_workers=2, timeout=30, use_processes=True, metrics=None,
+                 guild_concurrency=1, max_queued=None, guild_max_queued=5):
+        self.ytdl_options = ytdl_options
+        self.metrics = metrics
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.use_processes = use_processes
+        self.executor = None
+        self.inflight = {}
+        self.coalesced = 0
+        self.rejected = 0
+        # Scheduling: one fair queue of guilds per priority, with play-now work never capped or rejected
+        self.guild_concurrency = guild_concurrency
+        self.max_queued = max_queued or {PRIORITY_SEARCH: 100, PRIORITY_BACKGROUND: 500}
+        self.guild_max_queued = guild_max_queued
+        self.queues = {priority: OrderedDict() for priority in (PRIORITY_PLAY, PRIORITY_SEARCH, PRIORITY_BACKGROUND)}
+        self.queued = {priority: 0 for priority in self.queues}
+        self.running = 0
+        self.running_per_guild = defaultdict(int)
+        self.closed = False
+
+    def get_executor(self):
+        if self.executor is None:
+            executor_class = ProcessPoolExecutor if self.use_processes else ThreadPoolExecutor
+            self.executor = executor_class(
+                max_workers=self.max_workers,
+                initializer=_init_extraction_worker,
+                initargs=(self.ytdl_options,)
+            )
+        return self.executor
+
+    async def extract(self, url, extra_options=None, priority=PRIORITY_SEARCH, guild_id=None, concurrency=None):
+        # concurrency lets a batch from one guild run more than guild_concurrency lookups side by side
+        key = (url, tuple(sorted(extra_options.items()))) if extra_options else url
+        job = self.inflight.get(key)
+        if job is not None:
+            self.coalesced += 1
+            if not job.started and priority < job.priority:
+                # Someone needs this sooner, so move it to the more urgent queue
+                self.dequeue(job)
+                self.enqueue(job, priority)
+                self.dispatch()
+        else:
+            self.admit(priority, guild_id, concurrency)
+            job = ExtractionJob(key, url, extra_options, guild_id, priority, asyncio.get_running_loop().create_future(), concurrency)
+            self.inflight[key] = job
+            self.enqueue(job, priority)
+            self.dispatch()
+        # Shield so one cancelled caller doesn't cancel the lookup for everyone sharing it
+        job.waiters += 1
+        try:
+            return await asyncio.shield(job.future)
+        except asyncio.CancelledError:
+            if job.waiters == 1 and not job.started and not job.future.done():
+                # Nobody wants it any more, so don't let it hold a queue slot
+                self.dequeue(job)
+                self.inflight.pop(job.key, None)
+                job.future.cancel()
+            raise
+        finally:
+            job.waiters -= 1
+
+    def admit(self, priority, guild_id, concurrency=None):
+        if priority == PRIORITY_PLAY:
+            return
+        guild_queue = self.queues[priority].get(guild_id)
+        guild_max_queued = max(self.guild_max_queued, concurrency or 0)
+        if self.queued[priority] >= self.max_queued[priority] or (guild_queue and len(guild_queue) >= guild_max_queued):
+            self.rejected += 1
+            if self.metrics:
+                self.metrics.increment('extraction_rejected_total')
+            raise ExtractionOverloaded("Too many lookups are waiting, please try again shortly")
+
+    def enqueue(self, job, priority):
+        job.priority = priority
+        self.queues[priority].setdefault(job.guild_id, deque()).append(job)
+        self.queued[priority] += 1
+
+    def dequeue(self, job):
+        guild_queues = self.queues[job.priority]
+        jobs = guild_queues[job.guild_id]
+        jobs.remove(job)
+        if not jobs:
+            del guild_queues[job.guild_id]
+        self.queued[job.priority] -= 1
+
+    def next_job(self):
+        # Keep a worker free for play-now lookups so they never wait behind bulk work
+        reserved = 1 if self.max_workers > 1 else 0
+        for priority, guild_queues in self.queues.items():
+            if priority != PRIORITY_PLAY and self.running >= self.max_workers - reserved:
+                return None
+            for guild_id in list(guild_queues):
+                jobs = guild_queues[guild_id]
+                limit = jobs[0].concurrency or self.guild_concurrency
+                if priority != PRIORITY_PLAY and self.running_per_guild[guild_id] >= limit:
+                    continue
+                job = jobs.popleft()
+                if jobs:
+                    guild_queues.move_to_end(guild_id)
+                else:
+                    del guild_queues[guild_id]
+                self.queued[priority] -= 1
+                return job
+        return None
+
+    def dispatch(self):
+        while self.running < self.max_workers and not self.closed:
+            job = self.next_job()
+            if job is None:
+                return
+            job.started = True
+            self.running += 1
+            self.running_per_guild[job.guild_id] += 1
+            asyncio.ensure_future(self.run_job(job))
+
+    async def run_job(self, job):
+        work = None
+        try:
+            work = self.submit(job.url, job.extra_options)
+            result = await self.run_extraction(work)
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self.inflight.pop(job.key, None)
+            self.running_per_guild[job.guild_id] -= 1
+            if not self.running_per_guild[job.guild_id]:
+                del self.running_per_guild[job.guild_id]
+            if work is not None and not work.done():
+                # A timed-out call still occupies its worker, so keep the slot until it really returns
+                await asyncio.gather(work, return_exceptions=True)
+            self.running -= 1
+            self.dispatch()
+
+    def submit(self, url, extra_options=None):
+        return asyncio.get_running_loop().run_in_executor(self.get_executor(), _extract_in_worker, url, extra_options)
+
+    async def run_extraction(self, work):
+        start = time.perf_counter()
+        try:
+            return await asyncio.wait_for(asyncio.shield(work), timeout=self.timeout)
+        except BrokenProcessPool:
+            self.executor = None
+            self.record_failure()
+            raise
+        except Exception:
+            self.record_failure()
+            raise
+        finally:
+            if self.metrics:
+                self.metrics.observe('extraction_seconds', time.perf_counter() - start)
+
+    def record_failure(self):
+        if self.metrics:
+            self.metrics.increment('extraction_errors_total')
+
+    async def warm(self):
+        loop = asyncio.get_running_loop()
+        executor = self.get_executor()
+        await asyncio.gather(*(loop.run_in_executor(executor, _warm_worker) for _ in range(self.max_workers)))
+
+    def shutdown(self):
+        self.closed = True
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+
+class MusicCommandTree(app_commands.CommandTree):
+    async def interaction_check(self, interaction):
+        # Saved guild state is read off the event loop before any command touches it
+        if interaction.guild_id is not None and interaction.type is discord.InteractionType.application_command:
+            await self.client.load_guild(interaction.guild_id)
+        return True
 
 
 class MusicBot(commands.Bot):
@@ -13,13 +1323,22 @@ class MusicBot(commands.Bot):
         intents.message_content = True
         intents.voice_states = True
         
-        super().__init__(command_prefix='!', intents=intents)
+        # Shard workers started by ShardSupervisor get their shard through the environment
+        shard_options = {}
+        if os.environ.get('MUSICBOT_SHARD_COUNT'):
+            shard_options['shard_id'] = int(os.environ['MUSICBOT_SHARD_ID'])
+            shard_options['shard_count'] = int(os.environ['MUSICBOT_SHARD_COUNT'])
+        
+        super().__init__(command_prefix='!', intents=intents, tree_cls=MusicCommandTree, **shard_options)
         self.server_id = 123
         self.commands_channel_id = 123
         
-        self.queues = {}
-        self.loop_states = {}
-        self.now_playing = {}
+        # Guilds without voice are forgotten after guild_idle_ttl; queues are trimmed past guild_memory_budget bytes
+        self.guild_idle_ttl = 30 * 60
+        self.guild_memory_budget = 64 * 1024 ** 2
+        self.guild_sweep_interval = 60
+        self.guild_states = GuildRegistry(self.restore_guild, idle_ttl=self.guild_idle_ttl, memory_budget=self.guild_memory_budget)
+        self.guild_sweep_task = None
         
         self.ytdl_format_options = {
             'format': 'bestaudio/best',
@@ -34,72 +1353,470 @@ class MusicBot(commands.Bot):
             'default_search': 'auto',
         }
 
+        self.volume = 1.0
+        self.opus_passthrough = True
+
         self.ffmpeg_options = {
-            'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5 -probesize 25M -analyzeduration 25M',
+            'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5',
+            # Deep probing is only needed when yt-dlp couldn't tell us what the stream is
+            'probe_options': '-probesize 25M -analyzeduration 25M',
+            'fast_probe_options': '-probesize 32k -analyzeduration 0',
             'options': '-vn -b:a 128k -ac 2'
         }
 
-        self.ytdl = yt_dlp.YoutubeDL(self.ytdl_format_options)
-        self.voice_channel_check_task = None
+        self.metrics = Metrics()
+        self.metrics_host = '127.0.0.1'
+        # Set metrics_port to serve Prometheus text on /metrics, or metrics_json_path for periodic JSON dumps
+        self.metrics_port = None
+        self.metrics_json_path = None
+        self.metrics_json_interval = 60
+        self.loop_lag_interval = 0.5
+        self.metrics_tasks = []
+        self.metrics_runner = None
+
+        self.extraction_workers = 4
+        self.extraction_timeout = 30
+        self.extraction_guild_concurrency = 1
+        self.extractor = None
+        self.idle_timeout = 60
+
+        self.status_min_interval = 1.0
+        self.status_updater = StatusUpdater(min_interval=self.status_min_interval)
+
+        self.command_hash_path = '.command_tree_hash'
+        self.startup_timings = {}
+        self.startup_reported = False
+
+        self.health_queue = None
+        self.health_interval = 5
+        self.health_task = None
+
+        self.search_cache_ttl = 600
+        self.search_cache_max_entries = 512
+        self.search_cache = SearchCache(ttl=self.search_cache_ttl, max_entries=self.search_cache_max_entries)
+
+        self.stream_url_expiry_margin = 300
+        self.stream_cache = StreamURLCache(expiry_margin=self.stream_url_expiry_margin)
+
+        self.suggestion_max_entries = 5000
+        self.suggestions = SuggestionIndex(max_entries=self.suggestion_max_entries)
+
+        # Set audio_cache_dir to keep played tracks on disk
+        self.audio_cache_dir = None
+        self.audio_cache_max_bytes = 2 * 1024 ** 3
+        self.audio_cache_max_duration = 15 * 60
+        self.audio_cache = None
+
+        self.playlist_first_chunk = 5
+        self.playlist_chunk_size = 100
+        self.playlist_max_tracks = 500
+        self.playlist_overload_retries = 6
+
+        # /playmany lookups are searches allowed to run this many at a time for their guild,
+        # half the extraction workers unless set
+        self.bulk_max_queries = 25
+        self.bulk_concurrency = None
+
+        # Set state_db_path to keep queues across restarts
+        self.state_db_path = None
+        self.state_flush_interval = 1
+        self.resume_on_startup = True
+        self.state_store = None
+        self.state_task = None
+
+        # Set metadata_db_path to remember searches and plays, and pre-warm the most popular ones on startup
+        self.metadata_db_path = None
+        self.metadata_warm_entries = 200
+        self.metadata_flush_interval = 5
+        self.metadata_store = None
+        self.metadata_task = None
+
+        self.recovery_max_retries = 3
+        self.recovery_tolerance = 5
+
+        self.register_metrics()
+
+    def register_metrics(self):
+        metrics = self.metrics
+        metrics.histogram('extraction_seconds', "Time spent in yt-dlp extraction")
+        metrics.histogram('ffmpeg_first_packet_seconds', "Time from spawning FFmpeg to the first audio packet")
+        metrics.histogram('track_gap_seconds', "Silence between the end of one track and the start of the next")
+        metrics.histogram('event_loop_lag_seconds', "Event loop scheduling delay", buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1))
+        metrics.counter('extraction_errors_total', "yt-dlp extractions that failed or timed out")
+        metrics.counter('extraction_rejected_total', "Lookups turned away by extraction admission control")
+        metrics.counter('playback_errors_total', "Errors while starting or advancing playback")
+        metrics.counter('player_errors_total', "Errors reported by the voice player")
+        metrics.counter('resolve_failures_total', "Tracks skipped because no stream could be resolved")
+        metrics.counter('stream_recoveries_total', "Broken streams resumed from their last position")
+        metrics.gauge('voice_sessions_active', "Connected voice clients", lambda: sum(1 for vc in self.voice_clients if vc.is_connected()))
+        metrics.gauge('guild_queue_depth', "Queued songs per guild", lambda: {state.guild_id: len(state.queue) for state in self.guild_states if state.queue}, label='guild')
+        metrics.gauge('guild_state_bytes', "Estimated memory held by per-guild state", lambda: self.guild_states.memory_usage()['bytes'])
+        metrics.gauge('guild_states', "Guilds with state held in memory", lambda: len(self.guild_states))
+        metrics.gauge('cache_hit_rate', "Cache hit rate", self.cache_hit_rates, label='cache')
+        metrics.gauge('extraction_running', "Extractions currently running", lambda: self.extractor.running)
+        metrics.gauge('extraction_queued', "Extractions waiting per priority", lambda: dict(self.extractor.queued), label='priority')
+        metrics.gauge('startup_seconds', "Seconds from process start to each startup stage", lambda: dict(self.startup_timings), label='stage')
+
+    def cache_hit_rates(self):
+        rates = {
+            'search': self.search_cache.stats()['hit_rate'],
+            'stream': self.stream_cache.stats()['hit_rate'],
+        }
+        if self.audio_cache:
+            rates['audio'] = self.audio_cache.stats()['hit_rate']
+        return rates
+
+    async def start_metrics(self):
+        self.metrics_tasks.append(self.loop.create_task(self.monitor_loop_lag()))
+        if self.metrics_json_path:
+            self.metrics_tasks.append(self.loop.create_task(self.dump_metrics()))
+        if self.metrics_port:
+            app = web.Application()
+            app.router.add_get('/metrics', self.handle_metrics)
+            self.metrics_runner = web.AppRunner(app)
+            await self.metrics_runner.setup()
+            await web.TCPSite(self.metrics_runner, self.metrics_host, self.metrics_port).start()
+
+    async def stop_metrics(self):
+        for task in self.metrics_tasks:
+            task.cancel()
+        self.metrics_tasks.clear()
+        if self.metrics_runner:
+            await self.metrics_runner.cleanup()
+            self.metrics_runner = None
+
+    async def handle_metrics(self, request):
+        return web.Response(text=self.metrics.render(), content_type='text/plain')
+
+    def health(self):
+        lag = self.metrics.histograms['event_loop_lag_seconds']
+        return {
+            'shard_id': self.shard_id,
+            'pid': os.getpid(),
+            'ready': self.is_ready(),
+            'latency': self.latency if self.is_ready() else None,
+            'guilds': len(self.guilds),
+            'voice_sessions': sum(1 for voice_client in self.voice_clients if voice_client.is_connected()),
+            'queued_songs': sum(len(state.queue) for state in self.guild_states),
+            'guild_state_bytes': self.guild_states.memory_usage()['bytes'],
+            'loop_lag_avg': lag.sum / lag.count if lag.count else 0.0,
+            'timestamp': time.time(),
+        }
+
+    async def report_health(self):
+        while True:
+            try:
+                self.health_queue.put_nowait(self.health())
+            except Exception as e:
+                print(f"Error reporting health: {e}")
+            await asyncio.sleep(self.health_interval)
+
+    async def monitor_loop_lag(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.loop_lag_interval)
+            self.metrics.observe('event_loop_lag_seconds', max(0.0, time.perf_counter() - start - self.loop_lag_interval))
+
+    async def dump_metrics(self):
+        while True:
+            await asyncio.sleep(self.metrics_json_interval)
+            try:
+                snapshot = json.dumps(self.metrics.snapshot(), default=str)
+                with open(self.metrics_json_path + '.tmp', 'w') as file:
+                    file.write(snapshot)
+                os.replace(self.metrics_json_path + '.tmp', self.metrics_json_path)
+            except Exception as e:
+                print(f"Error writing metrics: {e}")
+
+    def restore_guild(self, guild_id, saved=None):
+        if not self.state_store:
+            return GuildState(guild_id, GuildQueue(guild_id=guild_id))
+        
+        if saved is None:
+            saved = self.state_store.load_guild(guild_id)
+        items, loop_state, now_playing, position = saved
+        queue = GuildQueue((track for _, track in items), guild_id, self.state_store, [seq for seq, _ in items])
+        if now_playing:
+            # The interrupted song goes back to the front and resumes where it stopped
+            now_playing.start_offset = position
+            queue.push_front(now_playing)
+            self.state_store.set_now_playing(guild_id, None)
+        return GuildState(guild_id, queue, loop_state)
+
+    def get_guild_state(self, guild_id):
+        return self.guild_states.get(guild_id)
+
+    async def load_guild(self, guild_id):
+        state = self.guild_states.peek(guild_id)
+        if state is None and self.state_store:
+            saved = await self.loop.run_in_executor(self.state_store.executor, self.state_store.load_guild, guild_id)
+            # Something may have created the state while the read was running
+            state = self.guild_states.peek(guild_id)
+            if state is None:
+                return self.guild_states.add(self.restore_guild(guild_id, saved))
+        return self.guild_states.get(guild_id)
 
     def get_queue(self, guild_id):
-        if guild_id not in self.queues:
-            self.queues[guild_id] = []
-        return self.queues[guild_id]
+        return self.guild_states.get(guild_id).queue
     
     def get_loop_state(self, guild_id):
-        if guild_id not in self.loop_states:
-            self.loop_states[guild_id] = False
-        return self.loop_states[guild_id]
+        return self.guild_states.get(guild_id).loop_state
     
     def set_loop_state(self, guild_id, state):
-        self.loop_states[guild_id] = state
+        self.guild_states.get(guild_id).loop_state = state
+        if self.state_store:
+            self.state_store.set_loop_state(guild_id, state)
+
+    def clear_guild_state(self, guild_id):
+        self.cancel_playlist_ingest(guild_id)
+        state = self.guild_states.peek(guild_id)
+        if not state:
+            return
+        state.queue.clear()
+        if state.loop_state:
+            self.set_loop_state(guild_id, False)
+        if state.now_playing:
+            self.set_now_playing(guild_id, None)
+        self.status_updater.forget(guild_id)
 
     def get_now_playing(self, guild_id):
-        return self.now_playing.get(guild_id)
+        state = self.guild_states.peek(guild_id)
+        return state.now_playing if state else None
     
-    def set_now_playing(self, guild_id, song_data):
-        self.now_playing[guild_id] = song_data
+    def set_now_playing(self, guild_id, song_data, voice_channel_id=None):
+        state = self.guild_states.get(guild_id)
+        state.now_playing = song_data
+        if song_data is None:
+            state.current_source = None
+        if self.state_store:
+            self.state_store.set_now_playing(guild_id, song_data, voice_channel_id)
+
+    def playback_position(self, guild_id):
+        state = self.guild_states.peek(guild_id)
+        return state.current_source.position if state and state.current_source else None
+
+    def save_positions(self):
+        for state in self.guild_states:
+            if state.current_source:
+                self.state_store.set_position(state.guild_id, state.current_source.position)
+
+    async def sweep_guild_states(self):
+        self.guild_states.idle_ttl = self.guild_idle_ttl
+        self.guild_states.memory_budget = self.guild_memory_budget
+        while True:
+            await asyncio.sleep(self.guild_sweep_interval)
+            try:
+                for guild_id in self.guild_states.evict_idle(self.has_voice_session):
+                    self.status_updater.forget(guild_id)
+                    self.status_updater.forget(('idle', guild_id))
+                self.status_updater.prune()
+                self.guild_states.enforce_budget()
+            except Exception as e:
+                print(f"Error sweeping guild state: {e}")
+
+    def has_voice_session(self, guild_id):
+        guild = self.get_guild(guild_id)
+        return bool(guild and guild.voice_client)
+
+    async def persist_state(self):
+        while True:
+            await asyncio.sleep(self.state_flush_interval)
+            try:
+                self.save_positions()
+                await self.state_store.flush()
+            except Exception as e:
+                print(f"Error saving guild state: {e}")
+
+    async def warm_metadata(self):
+        searches, played = await self.loop.run_in_executor(
+            self.metadata_store.executor, self.metadata_store.hottest, self.metadata_warm_entries
+        )
+        # Coldest first, so the hottest searches are the last the LRU would evict
+        for query, hits, entries in reversed(searches):
+            self.search_cache.put(query, entries)
+            if not query.startswith(('http://', 'https://')):
+                self.suggestions.add(query, hits)
+        for title, play_count in played:
+            self.suggestions.add(title, play_count)
+        self.mark_startup('metadata_warm')
+
+    async def persist_metadata(self):
+        try:
+            await self.warm_metadata()
+        except Exception as e:
+            print(f"Error loading track metadata: {e}")
+        while True:
+            await asyncio.sleep(self.metadata_flush_interval)
+            try:
+                await self.metadata_store.flush()
+            except Exception as e:
+                print(f"Error saving track metadata: {e}")
+
+    async def resume_saved_sessions(self):
+        if not self.state_store:
+            return
+        for guild_id, voice_channel_id in self.state_store.saved_sessions():
+            try:
+                channel = self.get_channel(voice_channel_id)
+                if not channel or not any(not member.bot for member in channel.members):
+                    continue
+                if channel.guild.voice_client:
+                    continue
+                queue = (await self.load_guild(guild_id)).queue
+                if not queue:
+                    continue
+                voice_client = await self.safe_voice_connect(channel)
+                await self.play_next(guild_id, voice_client)
+            except Exception as e:
+                print(f"Error resuming guild {guild_id}: {e}")
 
     async def setup_hook(self):
-        self.voice_channel_check_task = self.loop.create_task(self.monitor_voice_channels())
+        # Built here rather than in __init__ so pool size and timeout set on the bot take effect
+        self.extractor = ExtractionService(
+            self.ytdl_format_options,
+            max_workers=self.extraction_workers,
+            timeout=self.extraction_timeout,
+            metrics=self.metrics,
+            guild_concurrency=self.extraction_guild_concurrency
+        )
+        self.search_cache.ttl = self.search_cache_ttl
+        self.search_cache.max_entries = self.search_cache_max_entries
+        self.status_updater.min_interval = self.status_min_interval
+        self.stream_cache.expiry_margin = self.stream_url_expiry_margin
+        self.suggestions.max_entries = self.suggestion_max_entries
+        if self.audio_cache_dir:
+            self.audio_cache = AudioCache(self.audio_cache_dir, max_bytes=self.audio_cache_max_bytes).load()
+        if self.state_db_path:
+            self.state_store = StateStore(self.state_db_path)
+            self.state_task = self.loop.create_task(self.persist_state())
+        self.guild_sweep_task = self.loop.create_task(self.sweep_guild_states())
+        if self.metadata_db_path:
+            self.metadata_store = MetadataStore(self.metadata_db_path)
+            self.metadata_task = self.loop.create_task(self.persist_metadata())
+        await self.start_metrics()
+        if self.health_queue is not None:
+            self.health_task = self.loop.create_task(self.report_health())
+
+        self.loop.create_task(self.warm_extractor())
+
+        # Every shard serves the same command tree, so only the first one needs to sync it
+        if not self.shard_id:
+            guild = discord.Object(id=self.server_id)
+            self.tree.copy_global_to(guild=guild)
+            await self.sync_commands(guild)
+        self.mark_startup('setup_hook')
+
+    def command_tree_hash(self, guild):
+        payload = [command.to_dict(self.tree) for command in self.tree.get_commands(guild=guild)]
+        payload.sort(key=lambda command: command['name'])
+        encoded = json.dumps({'guild': guild.id, 'commands': payload}, sort_keys=True, default=str)
+        return hashlib.sha256(encoded.encode()).hexdigest()
+
+    async def sync_commands(self, guild):
+        # Syncing is slow and rate limited, so skip it when the commands haven't changed
+        command_hash = self.command_tree_hash(guild)
+        try:
+            with open(self.command_hash_path) as file:
+                if file.read().strip() == command_hash:
+                    print("Command tree unchanged, skipping sync")
+                    return
+        except OSError:
+            pass
         
-        guild = discord.Object(id=self.server_id)
-        self.tree.copy_global_to(guild=guild)
         await self.tree.sync(guild=guild)
+        with open(self.command_hash_path, 'w') as file:
+            file.write(command_hash)
+        self.mark_startup('command_sync')
 
-    async def monitor_voice_channels(self):
-        await self.wait_until_ready()
-        while not self.is_closed():
-            try:
-                for voice_client in self.voice_clients:
-                    if voice_client.is_connected():
-                        members_in_vc = [member for member in voice_client.channel.members if not member.bot]
-                        
-                        if len(members_in_vc) == 0:
-                            await asyncio.sleep(60)
-                            
-                            members_in_vc_after = [member for member in voice_client.channel.members if not member.bot]
-                            if (voice_client.is_connected() and len(members_in_vc_after) == 0):
-                                commands_channel = self.get_channel(self.commands_channel_id)
-                                if commands_channel:
-                                    embed = discord.Embed(
-                                        title="Voice Channel Left",
-                                        description="Left voice channel due to no one being in VC for 1 minute",
-                                        color=0xFFFFFF
-                                    )
-                                    await commands_channel.send(embed=embed)
-                                guild_id = voice_client.guild.id
-                                if guild_id in self.queues:
-                                    self.queues[guild_id].clear()
-                                if guild_id in self.loop_states:
-                                    self.loop_states[guild_id] = False
-                                if guild_id in self.now_playing:
-                                    del self.now_playing[guild_id]
-                                await voice_client.disconnect()
-            except Exception as e:
-                print(f"Error in monitor_voice_channels: {e}")
-            await asyncio.sleep(10)
+    async def warm_extractor(self):
+        try:
+            await self.extractor.warm()
+        except Exception as e:
+            print(f"Error warming extractor: {e}")
+        self.mark_startup('extractor_warm')
+
+    def mark_startup(self, stage):
+        if stage in self.startup_timings:
+            return
+        self.startup_timings[stage] = time.perf_counter() - PROCESS_STARTED_AT
+        if not self.startup_reported and 'ready' in self.startup_timings and 'extractor_warm' in self.startup_timings:
+            self.startup_reported = True
+            self.startup_timings['first_playable'] = max(self.startup_timings['ready'], self.startup_timings['extractor_warm'])
+            report = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.startup_timings.items())
+            print(f"Startup timings: {report}")
+
+    async def close(self):
+        if self.state_store:
+            # Save before disconnecting voice, which would otherwise clear every guild's state
+            self.state_task.cancel()
+            self.save_positions()
+            self.state_store.close()
+        if self.metadata_store:
+            self.metadata_task.cancel()
+            self.metadata_store.close()
+        if self.guild_sweep_task:
+            self.guild_sweep_task.cancel()
+        if self.health_task:
+            self.health_task.cancel()
+        await self.stop_metrics()
+        if self.extractor:
+            self.extractor.shutdown()
+        if self.audio_cache:
+            await self.audio_cache.close()
+        await super().close()
+
+    def update_idle_timer(self, guild):
+        voice_client = guild.voice_client
+        if not voice_client or not voice_client.is_connected():
+            self.cancel_idle_timer(guild.id)
+            return
+
+        if any(not member.bot for member in voice_client.channel.members):
+            self.cancel_idle_timer(guild.id)
+            return
+        state = self.guild_states.get(guild.id)
+        if state.idle_timer is None:
+            state.idle_timer = self.loop.create_task(self.idle_disconnect(guild.id))
+
+    def cancel_idle_timer(self, guild_id):
+        state = self.guild_states.peek(guild_id)
+        if not state or not state.idle_timer:
+            return
+        task, state.idle_timer = state.idle_timer, None
+        if not task.done():
+            task.cancel()
+
+    async def idle_disconnect(self, guild_id):
+        try:
+            await asyncio.sleep(self.idle_timeout)
+        except asyncio.CancelledError:
+            return
+        # Drop our own entry first so the disconnect's voice state event doesn't cancel us
+        state = self.guild_states.peek(guild_id)
+        if state and state.idle_timer is asyncio.current_task():
+            state.idle_timer = None
+
+        try:
+            guild = self.get_guild(guild_id)
+            voice_client = guild.voice_client if guild else None
+            if not voice_client or not voice_client.is_connected():
+                return
+            members_in_vc = [member for member in voice_client.channel.members if not member.bot]
+            if len(members_in_vc) > 0:
+                return
+
+            commands_channel = self.get_channel(self.commands_channel_id)
+            if commands_channel:
+                embed = discord.Embed(
+                    title="Voice Channel Left",
+                    description=f"Left voice channel due to no one being in VC for {format_idle_time(self.idle_timeout)}",
+                    color=0xFFFFFF
+                )
+                self.status_updater.update(('idle', guild_id), commands_channel, embed, persistent=False)
+            self.clear_guild_state(guild_id)
+            await voice_client.disconnect()
+        except Exception as e:
+            print(f"Error in idle_disconnect: {e}")
 
     async def safe_voice_connect(self, voice_channel):
         max_retries = 3
@@ -135,96 +1852,392 @@ class MusicBot(commands.Bot):
                 return
             
             if queue:
-                song_data = queue.pop(0)
+                song_data = queue.advance()
                 await self.play_song(guild_id, voice_client, song_data)
             else:
                 self.set_loop_state(guild_id, False)
                 self.set_now_playing(guild_id, None)
         except Exception as e:
             print(f"Error in play_next: {e}")
+            self.metrics.increment('playback_errors_total')
+
+    def schedule_prefetch(self, guild_id):
+        state = self.guild_states.get(guild_id)
+        next_url = state.queue.peek().url if state.queue else None
 
-    async def play_song(self, guild_id, voice_client, song_data):
+        if state.prefetch:
+            task, url = state.prefetch
+            if url == next_url and not task.done():
+                return
+            if not task.done():
+                task.cancel()
+            state.prefetch = None
+
+        if next_url is None:
+            return
+        task = self.loop.create_task(self.prefetch_next(guild_id, next_url))
+        state.prefetch = (task, next_url)
+
+    async def prefetch_next(self, guild_id, url):
         try:
-            audio_url = await self.get_audio_url(song_data['url'])
-            
-            if not audio_url:
-                print("Failed to get audio URL")
-                await self.play_next(guild_id, voice_client)
+            video_id = extract_video_id(url)
+            if self.audio_cache and video_id in self.audio_cache.entries:
                 return
+            await self.resolve_stream(url, PRIORITY_BACKGROUND, guild_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error prefetching next song: {e}")
+
+    def input_options(self, ext, acodec, remote=True, protocol=None, start_offset=0):
+        options = []
+        if remote:
+            options.append(self.ffmpeg_options['before_options'])
+        
+        demuxer = FFMPEG_DEMUXERS.get(ext)
+        known = demuxer and acodec and acodec != 'none' and not (protocol or '').startswith('m3u8')
+        if known:
+            options.append(f"-f {demuxer} {self.ffmpeg_options['fast_probe_options']}")
+        else:
+            options.append(self.ffmpeg_options['probe_options'])
+        
+        if start_offset:
+            options.append(f"-ss {start_offset:.2f}")
+        return " ".join(options)
+
+    def create_audio_source(self, source, acodec, before_options=None):
+        if not self.opus_passthrough:
+            audio_source = discord.FFmpegPCMAudio(source, before_options=before_options, options=self.ffmpeg_options['options'])
+            return discord.PCMVolumeTransformer(audio_source, volume=self.volume)
+        
+        # Opus sources at full volume are copied straight through; anything else is
+        # encoded by FFmpeg so the voice client never touches PCM in Python
+        if acodec == 'opus' and self.volume == 1.0:
+            return discord.FFmpegOpusAudio(source, codec='copy', before_options=before_options, options='-vn')
+        options = '-vn' if self.volume == 1.0 else f'-vn -af volume={self.volume}'
+        return discord.FFmpegOpusAudio(source, bitrate=128, before_options=before_options, options=options)
+
+    def update_status(self, guild_id):
+        song_data = self.get_now_playing(guild_id)
+        if not song_data:
+            return
+        channel = self.get_channel(song_data.request_channel_id)
+        if not channel:
+            return
+        
+        embed = discord.Embed(
+            title="🎵 Now Playing",
+            description=f"**{song_data.title}**",
+            color=0xFFFFFF
+        )
+        if song_data.duration:
+            duration = song_data.duration
+            embed.add_field(name="Duration", value=f"{duration//60}:{duration%60:02d}", inline=True)
+        if song_data.uploader:
+            embed.add_field(name="Uploader", value=song_data.uploader, inline=True)
+        
+        if self.get_loop_state(guild_id):
+            embed.add_field(name="Loop", value="🔁 Enabled", inline=True)
+        
+        embed.set_footer(text=f"Requested by {song_data.requester_name}")
+        self.status_updater.update(guild_id, channel, embed)
+
+    def should_recover(self, source, song_data, error):
+        if error:
+            return True
+        # FFmpeg exits cleanly when its input drops for good, so a short track means a broken stream
+        return source.ended and bool(song_data.duration) and source.position < song_data.duration - self.recovery_tolerance
+
+    async def recover_song(self, guild_id, voice_client, song_data, position):
+        state = self.guild_states.get(guild_id)
+        track, attempts, last_position = state.recovery or (None, 0, 0)
+        # Retries are for streams that keep failing at the same spot, not for rare drops in a long track
+        if track is not song_data or position - last_position > 30:
+            attempts = 0
+        if attempts >= self.recovery_max_retries or not voice_client.is_connected():
+            print(f"Giving up on recovering {song_data.title}")
+            state.recovery = None
+            await self.play_next(guild_id, voice_client)
+            return
+        
+        state.recovery = (song_data, attempts + 1, position)
+        self.metrics.increment('stream_recoveries_total')
+        print(f"Stream for {song_data.title} broke at {position:.1f}s, resuming")
+        # The signed URL is the usual culprit, so force a fresh one
+        self.stream_cache.invalidate(extract_video_id(song_data.url) or song_data.url)
+        song_data.stream = None
+        song_data.start_offset = position
+        await self.play_song(guild_id, voice_client, song_data, recovering=True)
+
+    async def play_song(self, guild_id, voice_client, song_data, recovering=False):
+        try:
+            state = self.guild_states.get(guild_id)
+            if not recovering:
+                state.recovery = None
+
+            video_id = extract_video_id(song_data.url)
+            cached_path = self.audio_cache.get(video_id) if self.audio_cache and video_id else None
             
-            audio_source = discord.FFmpegPCMAudio(
-                audio_url,
-                **self.ffmpeg_options
-            )
+            if cached_path:
+                ext = os.path.splitext(cached_path)[1][1:]
+                acodec = 'opus' if ext in ('webm', 'opus') else None
+                before_options = self.input_options(ext, acodec, remote=False, start_offset=song_data.start_offset)
+                audio_source = self.create_audio_source(cached_path, acodec, before_options)
+            else:
+                stream = song_data.stream
+                if not stream or not self.stream_is_fresh(stream):
+                    stream = await self.resolve_stream(song_data.url, PRIORITY_PLAY, guild_id)
+                    song_data.stream = stream
+                
+                if not stream:
+                    print("Failed to get audio URL")
+                    self.metrics.increment('resolve_failures_total')
+                    await self.play_next(guild_id, voice_client)
+                    return
+                
+                before_options = self.input_options(
+                    stream.get('ext'),
+                    stream.get('acodec'),
+                    protocol=stream.get('protocol'),
+                    start_offset=song_data.start_offset
+                )
+                audio_source = self.create_audio_source(stream['url'], stream.get('acodec'), before_options)
+                
+                if self.audio_cache and video_id and song_data.duration and song_data.duration <= self.audio_cache_max_duration:
+                    self.audio_cache.schedule_download(video_id, stream, self.loop)
             
-            audio_source = discord.PCMVolumeTransformer(audio_source, volume=0.5)
+            audio_source = TimedAudioSource(audio_source, self.metrics, song_data.start_offset)
             
             def after_playing(error):
+                state.track_ended_at = time.perf_counter()
                 if error:
                     print(f'Player error: {error}')
-                coro = self.play_next(guild_id, voice_client)
+                    self.metrics.increment('player_errors_total')
+                if state.current_source is audio_source and self.should_recover(audio_source, song_data, error):
+                    coro = self.recover_song(guild_id, voice_client, song_data, audio_source.position)
+                else:
+                    coro = self.play_next(guild_id, voice_client)
                 asyncio.run_coroutine_threadsafe(coro, self.loop)
             
             if voice_client.is_playing():
                 voice_client.stop()
             
+            # Set before play(): if FFmpeg dies at once the callback can fire before play() returns
+            state.current_source = audio_source
             voice_client.play(audio_source, after=after_playing)
-            self.set_now_playing(guild_id, song_data)
+            ended_at, state.track_ended_at = state.track_ended_at, None
+            if ended_at is not None:
+                self.metrics.observe('track_gap_seconds', time.perf_counter() - ended_at)
+            if not recovering:
+                self.suggestions.add(song_data.title)
+                if self.metadata_store and video_id:
+                    format_id = song_data.stream.get('format_id') if song_data.stream and not cached_path else None
+                    self.metadata_store.record_play(video_id, song_data, format_id)
+            self.set_now_playing(guild_id, song_data, voice_client.channel.id)
+            # Loop repeats and later plays start from the beginning again
+            song_data.start_offset = 0
+            self.schedule_prefetch(guild_id)
             
-            channel = self.get_channel(song_data['request_channel_id'])
-            if channel:
-                embed = discord.Embed(
-                    title="🎵 Now Playing",
-                    description=f"**{song_data['title']}**",
-                    color=0xFFFFFF
-                )
-                if song_data.get('duration'):
-                    duration = song_data['duration']
-                    embed.add_field(name="Duration", value=f"{duration//60}:{duration%60:02d}", inline=True)
-                if song_data.get('uploader'):
-                    embed.add_field(name="Uploader", value=song_data['uploader'], inline=True)
-                
-                if self.get_loop_state(guild_id):
-                    embed.add_field(name="Loop", value="🔁 Enabled", inline=True)
-                
-                embed.set_footer(text=f"Requested by {song_data['requester_name']}")
-                await channel.send(embed=embed)
+            self.update_status(guild_id)
                 
         except Exception as e:
             print(f"Error playing song: {e}")
+            self.metrics.increment('playback_errors_total')
+            await self.play_next(guild_id, voice_client)
+
+    def playlist_options(self, start, end):
+        return {
+            'extract_flat': 'in_playlist',
+            'noplaylist': False,
+            'playlist_items': f"{start}-{end}",
+        }
+
+    async def fetch_playlist_chunk(self, url, start, end, requester_name, request_channel_id,
+                                   priority=PRIORITY_SEARCH, guild_id=None):
+        data = await self.extractor.extract(url, self.playlist_options(start, end), priority, guild_id)
+        entries = [entry for entry in data.get('entries') or [] if entry]
+        tracks = [
+            Track.from_entry(entry, requester_name=requester_name, request_channel_id=request_channel_id)
+            for entry in entries
+        ]
+        return data, tracks
+
+    def start_playlist_ingest(self, guild_id, url, start, requester_name, request_channel_id):
+        self.cancel_playlist_ingest(guild_id)
+        state = self.guild_states.get(guild_id)
+        task = self.loop.create_task(self.ingest_playlist(guild_id, url, start, requester_name, request_channel_id))
+        state.playlist_task = task
+
+        def forget(task):
+            if state.playlist_task is task:
+                state.playlist_task = None
+        task.add_done_callback(forget)
+
+    def cancel_playlist_ingest(self, guild_id):
+        state = self.guild_states.peek(guild_id)
+        if not state or not state.playlist_task:
+            return
+        task, state.playlist_task = state.playlist_task, None
+        if not task.done():
+            task.cancel()
+
+    async def ingest_playlist(self, guild_id, url, start, requester_name, request_channel_id):
+        try:
+            retries = 0
+            while start <= self.playlist_max_tracks:
+                end = min(start + self.playlist_chunk_size - 1, self.playlist_max_tracks)
+                try:
+                    _, tracks = await self.fetch_playlist_chunk(
+                        url, start, end, requester_name, request_channel_id, PRIORITY_BACKGROUND, guild_id
+                    )
+                except ExtractionOverloaded:
+                    # Background work is the first to be turned away, so wait for the queue to drain
+                    if retries >= self.playlist_overload_retries:
+                        raise
+                    retries += 1
+                    await asyncio.sleep(min(30, 2 ** retries))
+                    continue
+                retries = 0
+                queue = self.get_queue(guild_id)
+                was_empty = not queue
+                queue.extend(tracks)
+                if was_empty:
+                    await self.resume_if_idle(guild_id)
+                if len(tracks) < end - start + 1:
+                    break
+                start = end + 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error loading playlist: {e}")
+
+    async def resume_if_idle(self, guild_id):
+        guild = self.get_guild(guild_id)
+        voice_client = guild.voice_client if guild else None
+        if not voice_client or not voice_client.is_connected():
+            return
+        if voice_client.is_playing() or voice_client.is_paused():
+            self.schedule_prefetch(guild_id)
+        elif self.get_now_playing(guild_id) is None:
             await self.play_next(guild_id, voice_client)
 
+    async def search(self, query, guild_id=None, priority=PRIORITY_SEARCH, concurrency=None):
+        cached = self.search_cache.get(query)
+        if cached is not None:
+            if self.metadata_store:
+                self.metadata_store.record_hit(query)
+            return cached
+
+        if query.startswith(('http://', 'https://')):
+            # A direct link needs its full info anyway, so resolve the stream in the same pass
+            search_data = await self.extractor.extract(query, priority=priority, guild_id=guild_id, concurrency=concurrency)
+        else:
+            # Flat search only lists the results; the chosen one is resolved once when it plays
+            search_data = await self.extractor.extract(
+                f"ytsearch5:{query}", {'extract_flat': 'in_playlist'}, priority, guild_id, concurrency
+            )
+
+        search_results = search_data.get('entries', []) if 'entries' in search_data else [search_data]
+        search_results = [self.search_entry(result) for result in search_results if result]
+        if search_results:
+            self.search_cache.put(query, search_results)
+            if self.metadata_store:
+                self.metadata_store.record_search(query, search_results)
+            if not query.startswith(('http://', 'https://')):
+                self.suggestions.add(query)
+        return search_results
+
+    def search_entry(self, data):
+        entry = {
+            'id': data.get('id'),
+            'title': data.get('title', 'Unknown Title'),
+            'duration': int(data['duration']) if data.get('duration') else None,
+            'uploader': data.get('uploader') or data.get('channel'),
+            'webpage_url': data.get('webpage_url') or data.get('url'),
+            'stream': None,
+        }
+        if data.get('formats') or data.get('acodec'):
+            stream = self.select_stream(data)
+            if stream:
+                entry['stream'] = stream
+                self.stream_cache.put(extract_video_id(entry['webpage_url']) or entry['webpage_url'], stream)
+        return entry
+
+    def stream_is_fresh(self, stream):
+        return self.stream_cache.is_fresh(stream)
+
     async def get_audio_url(self, url):
+        stream = await self.resolve_stream(url)
+        return stream['url'] if stream else None
+
+    async def resolve_stream(self, url, priority=PRIORITY_PLAY, guild_id=None):
+        cache_key = extract_video_id(url) or url
+        cached_stream = self.stream_cache.get(cache_key)
+        if cached_stream:
+            return cached_stream
+
         try:
-            loop = asyncio.get_event_loop()
-            data = await loop.run_in_executor(None, lambda: self.ytdl.extract_info(url, download=False))
+            data = await self.extractor.extract(url, priority=priority, guild_id=guild_id)
             
             if 'entries' in data:
                 data = data['entries'][0]
-            
-            if 'url' in data:
-                return data['url']
-            else:
-                for format in data.get('formats', []):
-                    if format.get('acodec') != 'none' and format.get('vcodec') == 'none':
-                        return format['url']
-                
-                for format in data.get('formats', []):
-                    if format.get('url'):
-                        return format['url']
+
+            stream = self.select_stream(data)
+            if stream:
+                self.stream_cache.put(cache_key, stream)
+            return stream
                         
+        except ExtractionOverloaded:
+            pass
         except Exception as e:
             print(f"Error getting audio URL: {e}")
         
         return None
 
+    @staticmethod
+    def select_stream(data):
+        selected = None
+        if 'url' in data:
+            selected = data
+        else:
+            for format in data.get('formats', []):
+                if format.get('acodec') != 'none' and format.get('vcodec') == 'none':
+                    selected = format
+                    break
+
+            if selected is None:
+                for format in data.get('formats', []):
+                    if format.get('url'):
+                        selected = format
+                        break
+
+        if selected is None:
+            return None
+
+        return {
+            'url': selected['url'],
+            'format_id': selected.get('format_id'),
+            'ext': selected.get('ext'),
+            'acodec': selected.get('acodec'),
+            'vcodec': selected.get('vcodec'),
+            'asr': selected.get('asr'),
+            'abr': selected.get('abr'),
+            'audio_channels': selected.get('audio_channels'),
+            'protocol': selected.get('protocol'),
+            'http_headers': selected.get('http_headers'),
+            'resolved_at': time.time(),
+        }
+
 bot = MusicBot()
 
 @bot.event
 async def on_ready():
+    bot.mark_startup('ready')
     print(f'{bot.user} has connected to Discord!')
     print(f'Bot is in {len(bot.guilds)} guild(s)')
     await bot.change_presence(activity=discord.Activity(type=discord.ActivityType.listening, name="ZapBot"))
+    if bot.resume_on_startup:
+        await bot.resume_saved_sessions()
 
 @bot.event
 async def on_voice_state_update(member, before, after):
@@ -235,12 +2248,10 @@ async def on_voice_state_update(member, before, after):
     if member == bot.user and before.channel and not after.channel:
         print("Bot was disconnected from voice channel")
         guild_id = before.channel.guild.id
-        if guild_id in bot.queues:
-            bot.queues[guild_id].clear()
-        if guild_id in bot.loop_states:
-            bot.loop_states[guild_id] = False
-        if guild_id in bot.now_playing:
-            del bot.now_playing[guild_id]
+        bot.clear_guild_state(guild_id)
+
+    if not member.bot or member == bot.user:
+        bot.update_idle_timer(member.guild)
 
 async def connect_and_deafen(voice_channel):
     try:
@@ -263,8 +2274,88 @@ async def connect_and_deafen(voice_channel):
         print(f"Voice connection error: {e}")
         raise
 
+async def ensure_voice(interaction):
+    voice_client = interaction.guild.voice_client
+    
+    if not voice_client or not voice_client.is_connected():
+        voice_client = await bot.safe_voice_connect(interaction.user.voice.channel)
+    elif voice_client.channel != interaction.user.voice.channel:
+        if voice_client.is_playing():
+            voice_client.stop()
+        await voice_client.disconnect()
+        await asyncio.sleep(0.5)
+        voice_client = await bot.safe_voice_connect(interaction.user.voice.channel)
+    
+    return voice_client
+
+async def send_overloaded(interaction, error):
+    embed = discord.Embed(
+        title="Busy",
+        description=str(error),
+        color=0xFFFFFF
+    )
+    await interaction.followup.send(embed=embed, ephemeral=True)
+
+async def play_playlist(interaction, url):
+    guild_id = interaction.guild.id
+    requester_name = interaction.user.display_name
+    request_channel_id = interaction.channel.id
+    
+    try:
+        data, tracks = await bot.fetch_playlist_chunk(
+            url, 1, bot.playlist_first_chunk, requester_name, request_channel_id, guild_id=guild_id
+        )
+    except ExtractionOverloaded as e:
+        await send_overloaded(interaction, e)
+        return
+    except Exception as e:
+        print(f"Playlist error: {e}")
+        tracks = []
+    
+    if not tracks:
+        embed = discord.Embed(
+            title="No Results Found",
+            description="Could not load any songs from that playlist.",
+            color=0xFFFFFF
+        )
+        await interaction.followup.send(embed=embed, ephemeral=True)
+        return
+    
+    try:
+        voice_client = await ensure_voice(interaction)
+        
+        queue = bot.get_queue(guild_id)
+        queue.extend(tracks)
+        
+        total = data.get('playlist_count')
+        embed = discord.Embed(
+            title="📜 Playlist Queued",
+            description=f"**{data.get('title', 'Playlist')}**\n{total or 'Loading'} songs are being added to the queue",
+            color=0xFFFFFF
+        )
+        await interaction.followup.send(embed=embed)
+        
+        if len(tracks) == bot.playlist_first_chunk:
+            bot.start_playlist_ingest(guild_id, url, len(tracks) + 1, requester_name, request_channel_id)
+        
+        if not voice_client.is_playing() and not voice_client.is_paused():
+            await bot.play_next(guild_id, voice_client)
+        else:
+            bot.schedule_prefetch(guild_id)
+    
+    except Exception as e:
+        print(f"Play command error: {e}")
+        embed = discord.Embed(
+            title="Connection Error",
+            description="Failed to connect to voice channel. Please try again.",
+            color=0xFFFFFF
+        )
+        await interaction.followup.send(embed=embed, ephemeral=True)
+
+        await bot.cleanup_voice_client(guild_id)
+
 @bot.tree.command(name="play", description="Play a song from YouTube")
-@app_commands.describe(query="Song name or YouTube URL")
+@app_commands.describe(query="Song name, YouTube URL or playlist URL")
 async def play_slash(interaction: discord.Interaction, query: str):
     if not interaction.user.voice:
         embed = discord.Embed(
@@ -277,11 +2368,12 @@ async def play_slash(interaction: discord.Interaction, query: str):
 
     await interaction.response.defer()
     
+    if is_playlist_url(query):
+        await play_playlist(interaction, query)
+        return
+    
     try:
-        loop = asyncio.get_event_loop()
-        search_data = await loop.run_in_executor(None, lambda: bot.ytdl.extract_info(f"ytsearch5:{query}", download=False))
-        
-        search_results = search_data.get('entries', []) if 'entries' in search_data else [search_data]
+        search_results = await bot.search(query, interaction.guild.id)
         
         if not search_results:
             embed = discord.Embed(
@@ -308,25 +2400,14 @@ async def play_slash(interaction: discord.Interaction, query: str):
         await interaction.followup.send(embed=embed)
         first_result = search_results[0]
         
-        song_data = {
-            'url': first_result.get('webpage_url', first_result.get('original_url', query)),
-            'title': first_result.get('title', 'Unknown Title'),
-            'duration': first_result.get('duration'),
-            'uploader': first_result.get('uploader', 'Unknown'),
-            'requester_name': interaction.user.display_name,
-            'request_channel_id': interaction.channel.id
-        }
-        
-        voice_client = interaction.guild.voice_client
+        song_data = Track.from_entry(
+            first_result,
+            requester_name=interaction.user.display_name,
+            request_channel_id=interaction.channel.id,
+            fallback_url=query
+        )
         
-        if not voice_client or not voice_client.is_connected():
-            voice_client = await bot.safe_voice_connect(interaction.user.voice.channel)
-        elif voice_client.channel != interaction.user.voice.channel:
-            if voice_client.is_playing():
-                voice_client.stop()
-            await voice_client.disconnect()
-            await asyncio.sleep(0.5)
-            voice_client = await bot.safe_voice_connect(interaction.user.voice.channel)
+        voice_client = await ensure_voice(interaction)
         
         queue = bot.get_queue(interaction.guild.id)
         queue.append(song_data)
@@ -334,13 +2415,16 @@ async def play_slash(interaction: discord.Interaction, query: str):
         if not voice_client.is_playing() and not voice_client.is_paused():
             await bot.play_next(interaction.guild.id, voice_client)
         else:
+            bot.schedule_prefetch(interaction.guild.id)
             embed = discord.Embed(
                 title="🎵 Added to Queue",
-                description=f"**{song_data['title']}**\nPosition in queue: {len(queue)}",
+                description=f"**{song_data.title}**\nPosition in queue: {len(queue)}",
                 color=0xFFFFFF
             )
             await interaction.followup.send(embed=embed)
         
+    except ExtractionOverloaded as e:
+        await send_overloaded(interaction, e)
     except Exception as e:
         print(f"Play command error: {e}")
         embed = discord.Embed(
@@ -352,8 +2436,126 @@ async def play_slash(interaction: discord.Interaction, query: str):
 
         await bot.cleanup_voice_client(interaction.guild.id)
 
+@play_slash.autocomplete('query')
+async def play_autocomplete(interaction: discord.Interaction, current: str):
+    # Served from the local index only; a yt-dlp lookup here would miss Discord's deadline
+    return [app_commands.Choice(name=text, value=text) for text in bot.suggestions.suggest(current)]
+
+def split_queries(text):
+    return [query.strip() for query in re.split(r'[;\n]', text) if query.strip()]
+
+@bot.tree.command(name="playmany", description="Queue several songs at once")
+@app_commands.describe(queries="Song names or YouTube URLs, separated by ; or new lines")
+async def play_many_slash(interaction: discord.Interaction, queries: str):
+    if not interaction.user.voice:
+        embed = discord.Embed(
+            title="Error",
+            description="You need to be in a voice channel to play music!",
+            color=0xFFFFFF
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        return
+    
+    queries = split_queries(queries)[:bot.bulk_max_queries]
+    if not queries:
+        embed = discord.Embed(
+            title="Error",
+            description="Give at least one song, separated by ; or new lines.",
+            color=0xFFFFFF
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        return
+
+    await interaction.response.defer()
+    
+    guild_id = interaction.guild.id
+    requester_name = interaction.user.display_name
+    request_channel_id = interaction.channel.id
+    concurrency = bot.bulk_concurrency or max(1, bot.extraction_workers // 2)
+    semaphore = asyncio.Semaphore(concurrency)
+    voice_task = None
+    
+    async def lookup(query):
+        nonlocal voice_task
+        if is_playlist_url(query):
+            return None
+        async with semaphore:
+            search_results = await bot.search(query, guild_id, PRIORITY_SEARCH, concurrency)
+        if not search_results:
+            return None
+        # Join voice once there is something to play, while the other lookups carry on
+        if voice_task is None:
+            voice_task = asyncio.ensure_future(ensure_voice(interaction))
+        return Track.from_entry(search_results[0], requester_name=requester_name,
+                                request_channel_id=request_channel_id, fallback_url=query)
+    
+    # Take results in request order as they arrive
+    lookups = [asyncio.ensure_future(lookup(query)) for query in queries]
+    
+    try:
+        voice_client = None
+        was_idle = None
+        queue = bot.get_queue(guild_id)
+        tracks = []
+        reasons = []
+        for query, lookup_task in zip(queries, lookups):
+            try:
+                song_data = await lookup_task
+                reason = "use /play for playlists" if is_playlist_url(query) else "not found"
+            except ExtractionOverloaded:
+                song_data, reason = None, "busy, try again shortly"
+            except Exception as e:
+                print(f"Error looking up {query}: {e}")
+                song_data, reason = None, "not found"
+            tracks.append(song_data)
+            reasons.append(reason)
+            if song_data is None:
+                continue
+            if voice_client is None:
+                voice_client = await voice_task
+                was_idle = not voice_client.is_playing() and not voice_client.is_paused()
+            queue.append(song_data)
+            if was_idle and not voice_client.is_playing() and not voice_client.is_paused():
+                await bot.play_next(guild_id, voice_client)
+        
+        if voice_client is not None:
+            bot.schedule_prefetch(guild_id)
+    
+    except Exception as e:
+        for lookup_task in lookups:
+            lookup_task.cancel()
+        print(f"Play command error: {e}")
+        embed = discord.Embed(
+            title="Connection Error",
+            description="Failed to connect to voice channel. Please try again.",
+            color=0xFFFFFF
+        )
+        await interaction.followup.send(embed=embed, ephemeral=True)
+
+        await bot.cleanup_voice_client(guild_id)
+        return
+    
+    lines = []
+    for i, (query, song_data, reason) in enumerate(zip(queries, tracks, reasons), 1):
+        if song_data is None:
+            lines.append(f"{i}. ~~{query}~~ ({reason})")
+            continue
+        duration = song_data.duration
+        duration_str = f" ({duration//60}:{duration%60:02d})" if duration else ""
+        lines.append(f"{i}. {song_data.title}{duration_str}")
+    
+    added = sum(1 for song_data in tracks if song_data)
+    embed = discord.Embed(
+        title="📜 Songs Queued" if added else "No Results Found",
+        description="\n".join(lines)[:4000],
+        color=0xFFFFFF
+    )
+    embed.set_footer(text=f"Added {added} of {len(queries)} songs")
+    await interaction.followup.send(embed=embed, ephemeral=not added)
+
 @bot.tree.command(name="queue", description="Show the current music queue")
-async def queue_slash(interaction: discord.Interaction):
+@app_commands.describe(page="Page of the queue to show")
+async def queue_slash(interaction: discord.Interaction, page: Optional[int] = 1):
     queue = bot.get_queue(interaction.guild.id)
     loop_state = bot.get_loop_state(interaction.guild.id)
     now_playing = bot.get_now_playing(interaction.guild.id)
@@ -363,21 +2565,28 @@ async def queue_slash(interaction: discord.Interaction):
     if now_playing:
         embed.add_field(
             name="Now Playing",
-            value=f"**{now_playing['title']}**\n👤 {now_playing['requester_name']}",
+            value=f"**{now_playing.title}**\n👤 {now_playing.requester_name}",
             inline=False
         )
     
     if queue:
+        page_size = 10
+        page_count = (len(queue) + page_size - 1) // page_size
+        page = min(max(page or 1, 1), page_count)
+        start = (page - 1) * page_size
+
         description = ""
-        for i, song in enumerate(queue[:10], 1):
-            duration = f" ({song['duration']//60}:{song['duration']%60:02d})" if song.get('duration') else ""
-            description += f"**{i}. {song['title']}**{duration}\n"
-            description += f"   👤 {song['requester_name']}\n\n"
+        for i, song in enumerate(queue.page(start, page_size), start + 1):
+            duration = f" ({song.duration//60}:{song.duration%60:02d})" if song.duration else ""
+            description += f"**{i}. {song.title}**{duration}\n"
+            description += f"   👤 {song.requester_name}\n\n"
         
-        if len(queue) > 10:
-            description += f"... and {len(queue) - 10} more songs"
+        if len(queue) > start + page_size:
+            description += f"... and {len(queue) - start - page_size} more songs"
         
         embed.add_field(name="Up Next", value=description, inline=False)
+        if page_count > 1:
+            embed.set_footer(text=f"Page {page}/{page_count}")
     else:
         embed.add_field(
             name="Queue",
@@ -392,6 +2601,77 @@ async def queue_slash(interaction: discord.Interaction):
     
     await interaction.response.send_message(embed=embed)
 
+@bot.tree.command(name="shuffle", description="Shuffle the songs in the queue")
+async def shuffle_slash(interaction: discord.Interaction):
+    queue = bot.get_queue(interaction.guild.id)
+    
+    if len(queue) < 2:
+        embed = discord.Embed(
+            title="Error",
+            description="Not enough songs in the queue to shuffle!",
+            color=0xFFFFFF
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        return
+    
+    queue.shuffle()
+    bot.schedule_prefetch(interaction.guild.id)
+    
+    embed = discord.Embed(
+        title="🔀 Shuffled",
+        description=f"Shuffled {len(queue)} songs",
+        color=0xFFFFFF
+    )
+    await interaction.response.send_message(embed=embed)
+
+@bot.tree.command(name="remove", description="Remove a song from the queue")
+@app_commands.describe(position="Position of the song in the queue")
+async def remove_slash(interaction: discord.Interaction, position: int):
+    queue = bot.get_queue(interaction.guild.id)
+    
+    if position < 1 or position > len(queue):
+        embed = discord.Embed(
+            title="Error",
+            description=f"Position must be between 1 and {len(queue)}!" if queue else "The queue is empty!",
+            color=0xFFFFFF
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        return
+    
+    song = queue.remove(position - 1)
+    bot.schedule_prefetch(interaction.guild.id)
+    
+    embed = discord.Embed(
+        title="🗑️ Removed",
+        description=f"**{song.title}** was removed from the queue",
+        color=0xFFFFFF
+    )
+    await interaction.response.send_message(embed=embed)
+
+@bot.tree.command(name="move", description="Move a song to a different position in the queue")
+@app_commands.describe(source="Current position of the song", destination="New position of the song")
+async def move_slash(interaction: discord.Interaction, source: int, destination: int):
+    queue = bot.get_queue(interaction.guild.id)
+    
+    if not (1 <= source <= len(queue)) or not (1 <= destination <= len(queue)):
+        embed = discord.Embed(
+            title="Error",
+            description=f"Positions must be between 1 and {len(queue)}!" if queue else "The queue is empty!",
+            color=0xFFFFFF
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        return
+    
+    song = queue.move(source - 1, destination - 1)
+    bot.schedule_prefetch(interaction.guild.id)
+    
+    embed = discord.Embed(
+        title="↕️ Moved",
+        description=f"**{song.title}** moved to position {destination}",
+        color=0xFFFFFF
+    )
+    await interaction.response.send_message(embed=embed)
+
 @bot.tree.command(name="loop", description="Toggle loop for the current song")
 async def loop_slash(interaction: discord.Interaction):
     voice_client = interaction.guild.voice_client
@@ -417,6 +2697,7 @@ async def loop_slash(interaction: discord.Interaction):
     current_loop = bot.get_loop_state(interaction.guild.id)
     new_loop_state = not current_loop
     bot.set_loop_state(interaction.guild.id, new_loop_state)
+    bot.update_status(interaction.guild.id)
     
     if new_loop_state:
         embed = discord.Embed(
@@ -537,12 +2818,7 @@ async def stop_slash(interaction: discord.Interaction):
         voice_client.stop()
     
     guild_id = interaction.guild.id
-    if guild_id in bot.queues:
-        bot.queues[guild_id].clear()
-    if guild_id in bot.loop_states:
-        bot.loop_states[guild_id] = False
-    if guild_id in bot.now_playing:
-        del bot.now_playing[guild_id]
+    bot.clear_guild_state(guild_id)
     
     embed = discord.Embed(
         title="⏹️ Stopped",
@@ -568,12 +2844,7 @@ async def disconnect_slash(interaction: discord.Interaction):
         voice_client.stop()
     
     guild_id = interaction.guild.id
-    if guild_id in bot.queues:
-        bot.queues[guild_id].clear()
-    if guild_id in bot.loop_states:
-        bot.loop_states[guild_id] = False
-    if guild_id in bot.now_playing:
-        del bot.now_playing[guild_id]
+    bot.clear_guild_state(guild_id)
     
     await voice_client.disconnect()
     
@@ -584,7 +2855,127 @@ async def disconnect_slash(interaction: discord.Interaction):
     )
     await interaction.response.send_message(embed=embed)
 
+def run_shard(token, settings, health_queue):
+    shard_id = bot.shard_id
+    for name, value in settings.items():
+        setattr(bot, name, value)
+    # Processes can't share a metrics port or dump file
+    if bot.metrics_port:
+        bot.metrics_port += shard_id
+    if bot.metrics_json_path:
+        bot.metrics_json_path = f"{bot.metrics_json_path}.{shard_id}"
+    bot.health_queue = health_queue
+    bot.run(token)
+
+
+class ShardSupervisor:
+    def __init__(self, token, shard_count, settings=None, health_timeout=60, health_path='shard_health.json'):
+        self.token = token
+        self.shard_count = shard_count
+        self.settings = settings or {}
+        self.health_timeout = health_timeout
+        self.health_path = health_path
+        self.context = multiprocessing.get_context('spawn')
+        self.health_queue = self.context.Queue()
+        self.processes = {}
+        self.started_at = {}
+        self.restarts = {shard_id: 0 for shard_id in range(shard_count)}
+        self.restart_at = {}
+        self.health = {}
+
+    def start_shard(self, shard_id):
+        os.environ['MUSICBOT_SHARD_ID'] = str(shard_id)
+        os.environ['MUSICBOT_SHARD_COUNT'] = str(self.shard_count)
+        process = self.context.Process(
+            target=run_shard,
+            args=(self.token, self.settings, self.health_queue),
+            name=f"musicbot-shard-{shard_id}",
+            # Shards start their own extraction worker pools, which daemonic processes can't do
+            daemon=False
+        )
+        process.start()
+        self.processes[shard_id] = process
+        self.started_at[shard_id] = time.time()
+        self.health.pop(shard_id, None)
+
+    def restart_shard(self, shard_id, reason):
+        print(f"Restarting shard {shard_id}: {reason}")
+        process = self.processes.pop(shard_id)
+        if process.is_alive():
+            process.terminate()
+        process.join(10)
+        # Back off when a shard keeps crashing, e.g. from a bad token or a gateway outage,
+        # but start over once it has stayed up for a while
+        if time.time() - self.started_at[shard_id] > 600:
+            self.restarts[shard_id] = 0
+        self.restarts[shard_id] += 1
+        self.restart_at[shard_id] = time.time() + min(60, 2 ** self.restarts[shard_id])
+
+    def drain_health(self):
+        while True:
+            try:
+                report = self.health_queue.get_nowait()
+            except queue_module.Empty:
+                return
+            self.health[report['shard_id']] = report
+
+    def aggregate(self):
+        reports = list(self.health.values())
+        return {
+            'shards': self.shard_count,
+            'alive': sum(1 for process in self.processes.values() if process.is_alive()),
+            'ready': sum(1 for report in reports if report['ready']),
+            'guilds': sum(report['guilds'] for report in reports),
+            'voice_sessions': sum(report['voice_sessions'] for report in reports),
+            'queued_songs': sum(report['queued_songs'] for report in reports),
+            'restarts': dict(self.restarts),
+            'per_shard': {shard_id: self.health[shard_id] for shard_id in sorted(self.health)},
+        }
+
+    def check_shards(self):
+        now = time.time()
+        for shard_id, restart_at in list(self.restart_at.items()):
+            if now >= restart_at:
+                del self.restart_at[shard_id]
+                self.start_shard(shard_id)
+        for shard_id, process in list(self.processes.items()):
+            if not process.is_alive():
+                self.restart_shard(shard_id, f"exited with code {process.exitcode}")
+                continue
+            last_seen = self.health.get(shard_id, {}).get('timestamp', self.started_at[shard_id])
+            if now - last_seen > self.health_timeout:
+                self.restart_shard(shard_id, f"no health report for {int(now - last_seen)}s")
+
+    def run(self, interval=5):
+        for shard_id in range(self.shard_count):
+            self.start_shard(shard_id)
+        try:
+            while True:
+                time.sleep(interval)
+                self.drain_health()
+                self.check_shards()
+                if self.health_path:
+                    with open(self.health_path + '.tmp', 'w') as file:
+                        json.dump(self.aggregate(), file)
+                    os.replace(self.health_path + '.tmp', self.health_path)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for process in self.processes.values():
+                process.terminate()
+            for process in self.processes.values():
+                process.join(10)
+
+
 if __name__ == "__main__":
     bot.server_id = 1234
     bot.commands_channel_id = 1234
-    bot.run('Enter your bot token')
+    token = 'Enter your bot token'
+    # More than one shard runs each shard in its own process under a supervisor
+    shard_count = 1
+    
+    if shard_count > 1:
+        settings = {'server_id': bot.server_id, 'commands_channel_id': bot.commands_channel_id}
+        ShardSupervisor(token, shard_count, settings).run()
+    else:
+        bot.run(token)